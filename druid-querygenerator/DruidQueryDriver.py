@@ -34,8 +34,36 @@ import time
 
 #
 # Handle distributions
+# All the random draws come from one numpy Generator. Samples are drawn
+# sample_block_size at a time and buffered, so each query doesn't pay for
+# a NumPy call per sample.
 #
 
+random_generator = np.random.default_rng()
+sample_block_size = 1024
+
+def set_sample_block_size(block_size):
+    global sample_block_size
+    if block_size < 1:
+        print('Error: "sample_block_size" must be a positive integer')
+        exit()
+    sample_block_size = block_size
+
+class SampleBuffer: # Keeps a block of pre-drawn samples
+    def __init__(self, draw):
+        self.draw = draw
+        self.block_size = sample_block_size
+        self.samples = []
+    def get_sample(self):
+        # pop() is atomic, so the query threads never get the same sample
+        try:
+            return self.samples.pop()
+        except IndexError:
+            samples = self.draw(self.block_size).tolist()
+            sample = samples.pop()
+            self.samples = samples
+            return sample
+
 class DistConstant:
     def __init__(self, value):
         self.value = value
@@ -48,27 +76,30 @@ class DistUniform:
     def __init__(self, min_value, max_value):
         self.min_value = min_value
         self.max_value = max_value
+        self.buffer = SampleBuffer(lambda n: random_generator.uniform(self.min_value, self.max_value+1, n))
     def __str__(self):
         return 'DistUniform(min_value='+str(self.min_value)+', max_value='+str(self.max_value)+')'
     def get_sample(self):
-        return np.random.uniform(self.min_value, self.max_value+1)
+        return self.buffer.get_sample()
 
 class DistExponential:
     def __init__(self, mean):
         self.mean = mean
+        self.buffer = SampleBuffer(lambda n: random_generator.exponential(scale = self.mean, size = n))
     def __str__(self):
         return 'DistExponential(mean='+str(self.mean)+')'
     def get_sample(self):
-        return np.random.exponential(scale = self.mean)
+        return self.buffer.get_sample()
 
 class DistNormal:
     def __init__(self, mean, stddev):
         self.mean = mean
         self.stddev = stddev
+        self.buffer = SampleBuffer(lambda n: random_generator.normal(self.mean, self.stddev, n))
     def __str__(self):
         return 'DistNormal(mean='+str(self.mean )+', stddev='+str(self.stddev)+')'
     def get_sample(self):
-        return np.random.normal(self.mean, self.stddev)
+        return self.buffer.get_sample()
 
 class DistNow:
     def __str__(self):
@@ -99,27 +130,33 @@ class DistUniformTime:
     def __init__(self, min_value, max_value):
         self.min_value = min_value
         self.max_value = max_value
+        # the bounds can change with each sample, so the buffer holds standard samples that are scaled to the bounds
+        self.buffer = SampleBuffer(random_generator.random)
     def __str__(self):
         return 'DistUniformTime(min_value='+str(self.min_value)+', max_value='+str(self.max_value)+')'
     def get_sample(self):
-        return datetime.fromtimestamp(np.random.uniform(dateutil.parser.isoparse(self.min_value.get_sample()).timestamp(), dateutil.parser.isoparse(self.max_value.get_sample()).timestamp())).isoformat()[:-3]
+        min_value = dateutil.parser.isoparse(self.min_value.get_sample()).timestamp()
+        max_value = dateutil.parser.isoparse(self.max_value.get_sample()).timestamp()
+        return datetime.fromtimestamp(min_value + (max_value - min_value) * self.buffer.get_sample()).isoformat()[:-3]
 
 class DistExponentialTime:
     def __init__(self, mean):
         self.mean = mean
+        self.buffer = SampleBuffer(random_generator.standard_exponential)
     def __str__(self):
         return 'DistExponentialTime(mean='+str(self.mean)+')'
     def get_sample(self):
-        return datetime.fromtimestamp(np.random.exponential(scale = dateutil.parser.isoparse(self.mean.get_sample()).timestamp())).isoformat()[:-3]
+        return datetime.fromtimestamp(dateutil.parser.isoparse(self.mean.get_sample()).timestamp() * self.buffer.get_sample()).isoformat()[:-3]
 
 class DistNormalTime:
     def __init__(self, mean, stddev):
         self.mean = mean
         self.stddev = stddev
+        self.buffer = SampleBuffer(random_generator.standard_normal)
     def __str__(self):
         return 'DistNormalTime(mean='+str(self.mean )+', stddev='+str(self.stddev)+')'
     def get_sample(self):
-        return datetime.fromtimestamp(np.random.normal(dateutil.parser.isoparse(self.mean.get_sample()).timestamp(), self.stddev)).isoformat()[:-3]
+        return datetime.fromtimestamp(dateutil.parser.isoparse(self.mean.get_sample()).timestamp() + self.stddev * self.buffer.get_sample()).isoformat()[:-3]
 
 def parse_distribution(desc):
     dist_type = desc['type'].lower()
@@ -175,6 +212,25 @@ def parse_timestamp_distribution(desc):
 
 
 
+def get_unique_values(var, cardinality):
+    # keeps the first occurrence of each value, the set makes each membership test O(1)
+    values = []
+    seen = set()
+    misses = 0
+    while len(values) < cardinality:
+        value = var.get_stochastic_value()
+        if value in seen:
+            misses += 1
+            # a distribution that keeps repeating itself for this long cannot produce enough distinct values
+            if misses > 20 * cardinality + 1000:
+                print('Error: Variable '+var.name+' specifies a cardinality of '+str(cardinality)+' but its distribution only produced '+str(len(values))+' distinct values')
+                exit()
+        else:
+            seen.add(value)
+            values.append(value)
+            misses = 0
+    return values
+
 class VarBase:
     def __init__(self, desc):
         self.name = desc['name']
@@ -186,15 +242,7 @@ class VarBase:
             if 'cardinality_distribution' not in desc.keys():
                 print('Variable '+self.name+' specifies a cardinality without a cardinality distribution')
                 exit()
-            card_list = []
-            for i in range(cardinality):
-                Value = None
-                while True:
-                    value = self.get_stochastic_value()
-                    if value not in card_list:
-                        break
-                card_list.append(value)
-            self.cardinality = card_list
+            self.cardinality = get_unique_values(self, cardinality)
             self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'])
 
     def get_stochastic_value(self):
@@ -290,15 +338,8 @@ class VarTimestamp(VarBase):
             if 'cardinality_distribution' not in desc.keys():
                 print('Variable '+self.name+' specifies a cardinality without a cardinality distribution')
                 exit()
-            self.cardinality = []
             self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'])
-            for i in range(cardinality):
-                Value = None
-                while True:
-                    value = self.get_stochastic_value()
-                    if value not in self.cardinality:
-                        break
-                self.cardinality.append(value)
+            self.cardinality = get_unique_values(self, cardinality)
 
     def __str__(self):
         return 'VarTimestamp(name='+self.name+', value_distribution='+str(self.value_distribution)+', cardinality='+str(self.cardinality)+', cardinality_distribution='+str(self.cardinality_distribution)+')'
@@ -423,6 +464,9 @@ def simulate_queries(config_file_name, runtime, total_queries, target_stdout, ta
     else:
         config = json.load(sys.stdin)
 
+    if 'sample_block_size' in config.keys():
+        set_sample_block_size(int(config['sample_block_size']))
+
     sim_end = SimEnd(total_queries, runtime)
 
     for query in config['queries']:
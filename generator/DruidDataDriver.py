@@ -3,14 +3,26 @@
 #
 
 import argparse
+import array
+import bisect
+import collections
 import math
 
 from confluent_kafka import Producer
+import csv
 import dateutil.parser
 from datetime import datetime, timedelta
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import json
 from kafka import KafkaProducer
+import multiprocessing
 import numpy as np
+import os
 import random
 import re
 from sortedcontainers import SortedList
@@ -69,6 +81,7 @@ class Clock:
         self.sim_time = start_time
         self.start_time = start_time
         self.time_type = time_type
+        self.wakeup = threading.Event() # interrupts real-time sleeps when the job ends
 
     def __str__(self):
         s = 'Clock(time='+str(self.sim_time)
@@ -134,6 +147,16 @@ class Clock:
     def resume(self, event):
         event.resume()
 
+    def advance(self, t):
+        # used by the discrete-event scheduler, which moves simulated time forward itself
+        # if the simulation is SIM_TO_REAL and has caught up with the current time, wait for the event in real-time
+        if self.time_type == 'SIM_TO_REAL':
+            wait = (t - datetime.now()).total_seconds()
+            if wait > 0:
+                # terminate() wakes the scheduler instead of leaving it asleep until the event
+                self.wakeup.wait(wait)
+        self.sim_time = t
+
     def now(self) -> datetime:
         if self.time_type != 'REAL':
             t = self.sim_time
@@ -168,93 +191,579 @@ class Clock:
                 self.time_type = 'REAL'
                 self.sim_time = datetime.now()
         else: # Real time
-            time.sleep(delta)
+            self.wakeup.wait(delta)
+
+    def wake_all(self):
+        self.wakeup.set()
 
 
 #
 # Set up the target
+# Every target has a print() method for each record, a flush() method that is
+# called when the job is stopped, and a close() method called once the job ends.
+# Along with each record, print() receives the values of the fields that make
+# up the message key, so the targets don't need to parse the record.
 #
 
+class RecordKey:
+    def __init__(self, fields, separator='', hash_name=None):
+        self.fields = fields
+        self.separator = separator
+        self.hash_name = hash_name
+        if hash_name is not None and hash_name not in hashlib.algorithms_available:
+            msg = 'Error: Unknown key hash "'+hash_name+'"'
+            raise Exception(msg)
+    def __str__(self):
+        return 'RecordKey(fields='+str(self.fields)+', separator='+self.separator+', hash='+str(self.hash_name)+')'
+    def get_key(self, record, values):
+        if values is None:
+            values = json.loads(record)
+        key = self.separator.join(['' if values.get(f) is None else str(values[f]) for f in self.fields])
+        if self.hash_name is not None:
+            key = hashlib.new(self.hash_name, key.encode('utf-8')).hexdigest()
+        return key
+
+def parse_record_key(target):
+    if 'topic_key' not in target.keys() or len(target['topic_key']) == 0:
+        return None
+    separator = target['key_separator'] if 'key_separator' in target.keys() else ''
+    hash_name = target['key_hash'].lower() if 'key_hash' in target.keys() else None
+    return RecordKey(target['topic_key'], separator, hash_name)
+
+def get_field_value(field, name):
+    # the value in a field string rendered by an element, e.g. '"name":"value"', '"name": {...}' or '"name": null'
+    value = field[len(name)+3:].strip()
+    if value == 'null':
+        return None
+    if value.startswith('"'):
+        return value[1:-1]
+    return value
+
+class LatencyHistogram: # Counts the send latencies of a target in buckets of seconds
+    bounds = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+    def __str__(self):
+        return 'LatencyHistogram(count='+str(self.count)+', sum='+str(self.sum)+')'
+    def observe(self, seconds):
+        # the targets observe a block or a delivery at a time, not every record
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+    def get_summary(self):
+        # cumulative bucket counts, in the form of a Prometheus histogram
+        with self.lock:
+            cumulative = list(itertools.accumulate(self.counts))
+            return {'count': self.count,
+                    'sum': round(self.sum, 6),
+                    'buckets': [[bound, n] for bound, n in zip(self.bounds, cumulative)] + [['+Inf', cumulative[-1]]]}
+
+class OutputBuffer: # Records gathered by one thread before they are written as a block
+    __slots__ = ('records', 'size', 'next_flush', 'lock')
+    def __init__(self, flush_interval):
+        # only contended when another thread flushes the buffer, which holds it until the block is written so blocks stay in order
+        self.lock = threading.Lock()
+        self.records = []
+        self.size = 0
+        self.next_flush = time.monotonic() + flush_interval
+
+class FlushTimer: # Flushes a target once per interval, so records don't wait for the next print to be written
+    def __init__(self, flush, interval):
+        self.flush = flush
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='FlushTimer', daemon=True)
+        self.thread.start()
+    def __str__(self):
+        return 'FlushTimer(interval='+str(self.interval)+')'
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+    def stop(self):
+        # the target is flushed once more after the timer has stopped, so it is closed by a single thread
+        self.stopped.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
 class PrintStdout:
-    lock = threading.Lock()
-    def print(self, record):
+    def __init__(self, buffer_size=65536, flush_interval=1.0):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock() # only held while a block is written
+        self.local = threading.local()
+        self.buffers = []
+        self.latency = LatencyHistogram()
+        # a thread that stops printing, or prints slowly, still has its records written within the interval
+        self.timer = FlushTimer(self.flush, flush_interval) if flush_interval > 0 else None
+    def get_buffer(self):
+        # each thread gathers its records in its own buffer, so they don't contend on the lock
+        try:
+            return self.local.buffer
+        except AttributeError:
+            buffer = OutputBuffer(self.flush_interval)
+            self.local.buffer = buffer
+            with self.lock:
+                self.buffers.append(buffer)
+            return buffer
+    def write(self, buffer):
+        # the caller holds the lock of the buffer
+        records, buffer.records = buffer.records, []
+        buffer.size = 0
+        buffer.next_flush = time.monotonic() + self.flush_interval
+        if len(records) == 0:
+            return
+        block = '\n'.join(records)+'\n'
+        start = time.perf_counter()
         with self.lock:
-            print(str(record))
-            sys.stdout.flush()
+            if hasattr(sys.stdout, 'buffer'):
+                sys.stdout.flush()
+                sys.stdout.buffer.write(block.encode('utf-8'))
+                sys.stdout.buffer.flush()
+            else:
+                sys.stdout.write(block)
+                sys.stdout.flush()
+        self.latency.observe(time.perf_counter() - start)
+    def print(self, record, values=None):
+        buffer = self.get_buffer()
+        with buffer.lock:
+            buffer.records.append(record)
+            buffer.size += len(record)+1
+            if buffer.size >= self.buffer_size or self.flush_interval == 0 or time.monotonic() >= buffer.next_flush:
+                self.write(buffer)
+    def flush(self):
+        for buffer in list(self.buffers):
+            with buffer.lock:
+                self.write(buffer)
+    def close(self):
+        if self.timer is not None:
+            self.timer.stop()
+        self.flush()
+    def __str__(self):
+        return 'PrintStdout(buffer_size='+str(self.buffer_size)+', flush_interval='+str(self.flush_interval)+')'
+
+class PrintNull: # Discards the records, optionally counting their bytes and hashing them
+    def __init__(self, count_bytes=False, hash_name=None):
+        self.count_bytes = count_bytes
+        self.hash_name = hash_name
+        if hash_name is not None and hash_name not in hashlib.algorithms_available:
+            msg = 'Error: Unknown null target hash "'+hash_name+'"'
+            raise Exception(msg)
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.digest = None if hash_name is None else hashlib.new(hash_name)
+        self.closed = False
     def __str__(self):
-        return '#printStdout()'
+        return 'PrintNull(count_bytes='+str(self.count_bytes)+', hash_name='+str(self.hash_name)+')'
+    def print(self, record, values=None):
+        # without options a record costs nothing but the call
+        if self.digest is not None:
+            # the digest is of the lines a file target would write, in the order they arrive
+            data = (record+'\n').encode('utf-8')
+            with self.lock:
+                self.digest.update(data)
+                self.bytes += len(data)
+        elif self.count_bytes:
+            data = (record+'\n').encode('utf-8')
+            with self.lock:
+                self.bytes += len(data)
+    def get_summary(self):
+        summary = {}
+        with self.lock:
+            if self.count_bytes or self.digest is not None:
+                summary['bytes'] = self.bytes
+            if self.digest is not None:
+                summary[self.hash_name] = self.digest.hexdigest()
+        return summary
+    def flush(self):
+        pass
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        summary = self.get_summary()
+        if len(summary) > 0:
+            # there is no output to hold the summary, so it goes to stderr
+            print('Info: Null target '+', '.join(k+' '+str(v) for k, v in summary.items()), file=sys.stderr)
+
+def parse_duration(duration):
+    # a number of seconds, or a string like 30s, 10m or 1h
+    if isinstance(duration, (int, float)):
+        return duration
+    if duration[-1].lower() == 's':
+        return int(duration[:-1])
+    elif duration[-1].lower() == 'm':
+        return int(duration[:-1]) * 60
+    elif duration[-1].lower() == 'h':
+        return int(duration[:-1]) * 60 * 60
+    else:
+        msg = 'Error: Unknown runtime value"'+duration+'"'
+        raise Exception(msg)
 
 class PrintFile:
     f = None
-    def __init__(self, file_name):
+    compression_suffixes = {'gzip': '.gz', 'zstd': '.zst'}
+    def __init__(self, file_name, buffer_size=65536, flush_interval=1.0, compression=None, rotate_bytes=None, rotate_records=None, rotate_interval=None, global_clock=None):
         self.file_name = file_name
-        self.f = open(file_name, 'w')
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.rotate_records = rotate_records
+        self.rotate_interval = rotate_interval
+        self.global_clock = global_clock
+        if compression is not None and compression not in self.compression_suffixes.keys():
+            msg = 'Error: Unknown file compression "'+compression+'"'
+            raise Exception(msg)
+        self.lock = threading.Lock()
+        self.latency = LatencyHistogram()
+        self.file_index = 0
+        if rotate_interval is not None:
+            self.window_end = global_clock.now() + timedelta(seconds=rotate_interval)
+        self.open()
+        # records printed before a pause in the job are still written to the file within the interval
+        self.timer = FlushTimer(self.flush, flush_interval) if flush_interval > 0 else None
     def __str__(self):
-        return 'PrintFile(file_name='+self.file_name+')'
-    def print(self, record):
-        self.f.write(str(record)+'\n')
+        return 'PrintFile(file_name='+self.file_name+', buffer_size='+str(self.buffer_size)+', compression='+str(self.compression)+')'
+    def get_file_name(self):
+        # rotated files are numbered, and compressed files get the suffix of the compression
+        name = self.file_name
+        suffix = self.compression_suffixes.get(self.compression, '')
+        if suffix != '' and name.endswith(suffix):
+            name = name[:-len(suffix)]
+        if self.rotate_bytes is not None or self.rotate_records is not None or self.rotate_interval is not None:
+            root, ext = os.path.splitext(name)
+            name = root+'.'+str(self.file_index).zfill(5)+ext
+        return name+suffix
+    def open(self):
+        # the file itself is unbuffered, the writer's buffer is the only one, so a flush reaches the file
+        self.raw = open(self.get_file_name(), 'wb', buffering=0)
+        if self.compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                msg = 'Error: zstd file compression requires the zstandard module'
+                raise Exception(msg)
+            stream = zstandard.ZstdCompressor().stream_writer(self.raw)
+        else:
+            stream = self.raw
+        self.f = io.BufferedWriter(stream, buffer_size=self.buffer_size)
+        self.file_bytes = 0
+        self.file_records = 0
+        self.next_flush = time.monotonic() + self.flush_interval
+    def close_file(self):
+        self.f.close()
+        if self.raw is not self.f.raw:
+            self.raw.close()
+    def rotate(self):
+        self.close_file()
+        self.file_index += 1
+        self.open()
+    def print(self, record, values=None):
+        data = (record+'\n').encode('utf-8')
+        with self.lock:
+            if (self.rotate_bytes is not None and self.file_bytes > 0 and self.file_bytes + len(data) > self.rotate_bytes) \
+                    or (self.rotate_records is not None and self.file_records >= self.rotate_records):
+                self.rotate()
+            elif self.rotate_interval is not None and self.global_clock.now() >= self.window_end:
+                while self.global_clock.now() >= self.window_end:
+                    self.window_end += timedelta(seconds=self.rotate_interval)
+                self.rotate()
+            self.f.write(data)
+            self.file_bytes += len(data)
+            self.file_records += 1
+            if self.flush_interval == 0 or time.monotonic() >= self.next_flush:
+                self.flush_file()
+                self.next_flush = time.monotonic() + self.flush_interval
+    def flush_file(self):
+        start = time.perf_counter()
         self.f.flush()
+        if self.f.raw is not self.raw:
+            # flushing the buffer doesn't flush the compressor, which would hold the records until the file is closed
+            self.f.raw.flush()
+        self.latency.observe(time.perf_counter() - start)
+    def flush(self):
+        with self.lock:
+            if not self.f.closed:
+                self.flush_file()
+    def close(self):
+        if self.timer is not None:
+            self.timer.stop()
+        with self.lock:
+            if not self.f.closed:
+                self.close_file()
 
 class PrintKafka:
     producer = None
     topic = None
-    def __init__(self, endpoint, topic, security_protocol, compression_type, topic_key):
+    def __init__(self, endpoint, topic, security_protocol, compression_type, record_key, delivery='sync', producer_config={}, producer=None):
         #print('PrintKafka('+str(endpoint)+', '+str(topic)+', '+str(security_protocol)+', '+str(compression_type)+')')
         self.endpoint = endpoint
-        self.producer = KafkaProducer(bootstrap_servers=endpoint, security_protocol=security_protocol, compression_type=compression_type) # , value_serializer=lambda v: json.dumps(v).encode('utf-8'))
+        if producer is None: # a stand-in producer can be passed in for testing
+            producer = KafkaProducer(bootstrap_servers=endpoint, security_protocol=security_protocol, compression_type=compression_type, **producer_config) # , value_serializer=lambda v: json.dumps(v).encode('utf-8'))
+        self.producer = producer
         self.topic = topic
-        self.topic_key=topic_key
+        self.record_key = record_key
+        self.delivery = delivery
+        self.delivery_failures = 0
+        self.latency = LatencyHistogram()
+        self.closed = False
     def __str__(self):
-        return 'PrintKafka(endpoint='+self.endpoint+', topic='+self.topic+', topic_key='+self.topic_key+')'
-    def print(self, record):
-        if len(self.topic_key) == 0:
-            self.producer.send(topic=self.topic, value=bytes(record, 'utf-8'))
+        return 'PrintKafka(endpoint='+self.endpoint+', topic='+self.topic+', record_key='+str(self.record_key)+', delivery='+self.delivery+')'
+    def on_delivery_error(self, exception):
+        # called from the producer's I/O thread
+        self.delivery_failures += 1
+    def on_delivery(self, sent, metadata):
+        self.latency.observe(time.perf_counter() - sent)
+    def print(self, record, values=None):
+        sent = time.perf_counter()
+        if self.record_key is None:
+            future = self.producer.send(topic=self.topic, value=bytes(record, 'utf-8'))
         else:
-            key = ''
-            json_record = json.loads(record)
-            for dim in self.topic_key:
-                key+=json_record[dim]
-            self.producer.send(topic=self.topic, value=bytes(record, 'utf-8'), key=bytes(key, 'utf-8'))
-        self.producer.flush()
+            key = self.record_key.get_key(record, values)
+            future = self.producer.send(topic=self.topic, value=bytes(record, 'utf-8'), key=bytes(key, 'utf-8'))
+        future.add_callback(self.on_delivery, sent)
+        future.add_errback(self.on_delivery_error)
+        # in async mode the producer batches the records in the background, they are only flushed when the job stops
+        if self.delivery == 'sync':
+            self.producer.flush()
+    def flush(self):
+        if not self.closed:
+            self.producer.flush()
+    def close(self):
+        self.flush()
+        self.closed = True
+        self.producer.close()
 
 class PrintConfluent:
     producer = None
     topic = None
     username = None
     password = None
-    def __init__(self, servers, topic, username, password, topic_key):
+    def __init__(self, servers, topic, username, password, record_key, producer=None):
         #print('PrintKafka('+str(endpoint)+', '+str(topic)+', '+str(security_protocol)+', '+str(compression_type)+')')
         self.servers = servers
-        self.producer = Producer({
-            'bootstrap.servers': servers,
-            'sasl.mechanisms': 'PLAIN',
-            'security.protocol': 'SASL_SSL',
-            'sasl.username': username,
-            'sasl.password': password
-        })
+        if producer is None: # a stand-in producer can be passed in for testing
+            producer = Producer({
+                'bootstrap.servers': servers,
+                'sasl.mechanisms': 'PLAIN',
+                'security.protocol': 'SASL_SSL',
+                'sasl.username': username,
+                'sasl.password': password
+            })
+        self.producer = producer
         self.topic = topic
         self.username = username
         self.password = password
-        self.topic_key = topic_key
+        self.record_key = record_key
+        self.delivery_failures = 0
+        self.latency = LatencyHistogram()
     def __str__(self):
-        return 'PrintConfluent(servers='+self.servers+', topic='+self.topic+', username='+self.username+', password='+self.password+', topic_key='+self.topic_key+')'
-    def print(self, record):
-        print('producing '+str(record))
-        if len(self.topic_key) == 0:
-            self.producer.produce(topic=self.topic, value=str(record))
+        return 'PrintConfluent(servers='+self.servers+', topic='+self.topic+', username='+self.username+', password='+self.password+', record_key='+str(self.record_key)+')'
+    def on_delivery(self, err, msg):
+        # called from poll() and flush()
+        if err is not None:
+            self.delivery_failures += 1
+        elif msg.latency() is not None:
+            self.latency.observe(msg.latency())
+    def produce(self, value, key):
+        while True:
+            try:
+                self.producer.produce(topic=self.topic, value=value, key=key, on_delivery=self.on_delivery)
+                return
+            except BufferError:
+                # the local producer queue is full, wait for some deliveries to make room
+                self.producer.poll(1)
+    def print(self, record, values=None):
+        if self.record_key is None:
+            self.produce(str(record), None)
         else:
-            key = ''
-            json_record = json.loads(record)
-            for dim in self.topic_key:
-                key+=json_record[dim]
-            self.producer.produce(topic=self.topic, value=str(record), key=key)
+            self.produce(str(record), self.record_key.get_key(record, values))
+        # serve the delivery callbacks without waiting
+        self.producer.poll(0)
+    def get_queue_depth(self):
+        # the records waiting in the producer to be delivered
+        return len(self.producer)
+    def flush(self):
         self.producer.flush()
+    def close(self):
+        self.flush()
+
+class PrintQueue: # Sends records from a worker process to the single writer process
+    def __init__(self, queue, global_clock, block_size=1000, flush_interval=1.0):
+        self.queue = queue
+        self.global_clock = global_clock
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.block = []
+        self.next_flush = time.monotonic() + flush_interval
+        self.lock = threading.Lock() # replay threads share the queue of their process
+        self.latency = LatencyHistogram()
+    def __str__(self):
+        return 'PrintQueue(block_size='+str(self.block_size)+', flush_interval='+str(self.flush_interval)+')'
+    def print(self, record, values=None):
+        # records are tagged with the time they were emitted so the writer can merge them in time order
+        with self.lock:
+            self.block.append((self.global_clock.now(), record, values))
+            # in real time a slow process would hold back the writer, so blocks are also sent after the flush interval
+            if len(self.block) >= self.block_size or time.monotonic() >= self.next_flush:
+                self.put_block()
+    def put_block(self):
+        if len(self.block) > 0:
+            # put() blocks while the writer is behind
+            start = time.perf_counter()
+            self.queue.put(self.block)
+            self.latency.observe(time.perf_counter() - start)
+            self.block = []
+        self.next_flush = time.monotonic() + self.flush_interval
+    def flush(self):
+        with self.lock:
+            self.put_block()
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        msg = 'Error: parquet, arrow and orc targets require the pyarrow module'
+        raise Exception(msg)
+    return pyarrow
+
+class PrintColumnar: # Writes the field values to Parquet, Arrow IPC or ORC files in row groups
+    def __init__(self, file_name, file_format, elements, row_group_size=100000, compression=None):
+        self.pa = import_pyarrow()
+        self.file_name = file_name
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.writer = None
+        self.schema = None
+        self.columns = None
+        self.rows = 0
+        self.latency = LatencyHistogram()
+        # without elements (replay) every column is a string, whatever the type of the values in the source
+        self.strings = elements is None
+        if elements is not None:
+            self.set_schema(self.pa.schema([(e.name, get_arrow_type(e, self.pa)) for e in elements]))
+    def __str__(self):
+        return 'PrintColumnar(file_name='+self.file_name+', file_format='+self.file_format+', row_group_size='+str(self.row_group_size)+')'
+    def set_schema(self, schema):
+        self.schema = schema
+        self.columns = {name: [] for name in schema.names}
+    def open(self):
+        if self.file_format == 'parquet':
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(self.file_name, self.schema, compression=self.compression or 'snappy')
+        elif self.file_format == 'arrow':
+            options = self.pa.ipc.IpcWriteOptions(compression=self.compression)
+            self.writer = self.pa.ipc.new_file(self.file_name, self.schema, options=options)
+        else:
+            import pyarrow.orc
+            self.writer = pyarrow.orc.ORCWriter(self.file_name, compression=self.compression or 'uncompressed')
+    def print(self, record, values=None):
+        with self.lock:
+            if self.schema is None:
+                # without emitters (replay), every field in the first record becomes a string column
+                self.set_schema(self.pa.schema([(name, self.pa.string()) for name in values.keys()]))
+            if self.strings:
+                for name, column in self.columns.items():
+                    column.append(get_string_value(values.get(name)))
+            else:
+                for name, column in self.columns.items():
+                    column.append(values.get(name))
+            self.rows += 1
+            if self.rows >= self.row_group_size:
+                self.write_row_group()
+    def write_row_group(self):
+        if self.rows == 0:
+            return
+        start = time.perf_counter()
+        if self.writer is None:
+            self.open()
+        table = self.pa.Table.from_pydict(self.columns, schema=self.schema)
+        if self.file_format == 'orc':
+            self.writer.write(table)
+        else:
+            self.writer.write_table(table)
+        self.latency.observe(time.perf_counter() - start)
+        self.columns = {name: [] for name in self.schema.names}
+        self.rows = 0
+    def flush(self):
+        with self.lock:
+            self.write_row_group()
+    def close(self):
+        with self.lock:
+            self.write_row_group()
+            if self.writer is not None:
+                self.writer.close()
 
 
 #
 # Handle distributions
+# All the random draws of a job come from its own RandomStreams, so jobs running in
+# the same process don't share them. Single samples are taken from a buffer of
+# samples drawn the job's block size at a time, so the per-record paths don't pay
+# for a NumPy call each.
 #
 
+class RandomStreams: # The numpy Generator and the python Random of one job, and the size of its sample blocks
+    def __init__(self, block_size=1024):
+        self.generator = np.random.default_rng()
+        self.random = random.Random()
+        self.set_block_size(block_size)
+    def __str__(self):
+        return 'RandomStreams(block_size='+str(self.block_size)+')'
+    def set_block_size(self, block_size):
+        # only the buffers created after this use the new size
+        if block_size < 1:
+            msg = 'Error: "sample_block_size" must be a positive integer.'
+            raise Exception(msg)
+        self.block_size = block_size
+    def seed(self, seed_sequence=None):
+        # the Generator and the Random get independent streams from the seed sequence, or fresh entropy without one
+        # the Random is reseeded in place, so its bound methods stay valid, and a new Generator drops the buffered samples
+        if seed_sequence is None:
+            seed_sequence = np.random.SeedSequence()
+        numpy_sequence, python_sequence = seed_sequence.spawn(2)
+        self.generator = np.random.default_rng(numpy_sequence)
+        self.random.seed(int(python_sequence.generate_state(1, np.uint64)[0]))
+
+class SampleBuffer: # Keeps a block of pre-drawn samples
+    def __init__(self, draw, streams, block_size=None):
+        self.draw = draw
+        self.streams = streams
+        if block_size is None:
+            block_size = streams.block_size
+        self.block_size = block_size
+        self.samples = []
+        self.generator = None
+    def __str__(self):
+        return 'SampleBuffer(block_size='+str(self.block_size)+')'
+    def get_sample(self):
+        # pop() is atomic, so threads sharing the buffer never get the same sample
+        try:
+            if self.generator is self.streams.generator:
+                return self.samples.pop()
+        except IndexError:
+            pass
+        return self.refill()
+    def refill(self):
+        # samples drawn from a replaced generator (after a fork, or a new seed) are dropped
+        generator = self.streams.generator
+        samples = self.draw(self.block_size).tolist()
+        sample = samples.pop()
+        self.samples = samples
+        self.generator = generator
+        return sample
+
 class DistConstant:
     def __init__(self, value):
         self.value = value
@@ -262,34 +771,171 @@ class DistConstant:
         return 'DistConstant(value='+str(self.value)+')'
     def get_sample(self):
         return self.value
+    def get_samples(self, n):
+        return np.full(n, self.value)
 
 class DistUniform:
-    def __init__(self, min_value, max_value):
+    def __init__(self, min_value, max_value, streams):
+        self.streams = streams
         self.min_value = min_value
         self.max_value = max_value
+        self.buffer = SampleBuffer(self.get_samples, streams)
     def __str__(self):
         return 'DistUniform(min_value='+str(self.min_value)+', max_value='+str(self.max_value)+')'
     def get_sample(self):
-        return np.random.uniform(self.min_value, self.max_value+1)
+        return self.buffer.get_sample()
+    def get_samples(self, n):
+        return self.streams.generator.uniform(self.min_value, self.max_value+1, n)
 
 class DistExponential:
-    def __init__(self, mean):
+    def __init__(self, mean, streams):
+        self.streams = streams
         self.mean = mean
+        self.buffer = SampleBuffer(self.get_samples, streams)
     def __str__(self):
         return 'DistExponential(mean='+str(self.mean)+')'
     def get_sample(self):
-        return np.random.exponential(scale = self.mean)
+        return self.buffer.get_sample()
+    def get_samples(self, n):
+        return self.streams.generator.exponential(scale = self.mean, size = n)
 
 class DistNormal:
-    def __init__(self, mean, stddev):
+    def __init__(self, mean, stddev, streams):
+        self.streams = streams
         self.mean = mean
         self.stddev = stddev
+        self.buffer = SampleBuffer(self.get_samples, streams)
     def __str__(self):
         return 'DistNormal(mean='+str(self.mean )+', stddev='+str(self.stddev)+')'
     def get_sample(self):
-        return np.random.normal(self.mean, self.stddev)
+        return self.buffer.get_sample()
+    def get_samples(self, n):
+        return self.streams.generator.normal(self.mean, self.stddev, n)
+
+class DistDiscrete: # Draws from a finite set of outcomes with given weights, using an alias table
+    def __init__(self, weights, values, streams):
+        self.streams = streams
+        if len(weights) == 0 or min(weights) < 0 or sum(weights) <= 0:
+            msg = 'Error: Discrete distribution requires a list of non-negative weights with a positive total'
+            raise Exception(msg)
+        if values is not None and len(values) != len(weights):
+            msg = 'Error: Discrete distribution has '+str(len(values))+' values but '+str(len(weights))+' weights'
+            raise Exception(msg)
+        self.weights = weights
+        self.values = values
+        self.set_alias_table(weights)
+        self.buffer = SampleBuffer(self.get_indexes, streams)
+    def __str__(self):
+        return 'DistDiscrete(weights='+str(self.weights)+', values='+str(self.values)+')'
+    def __len__(self):
+        return len(self.weights)
+    def set_alias_table(self, weights):
+        # Vose's alias method: each of the n columns holds its own outcome with probability prob[i]
+        # and the alias[i] outcome otherwise, so a sample is one uniform draw and one comparison
+        n = len(weights)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while len(small) > 0 and len(large) > 0:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        self.prob_array = np.array(prob)
+        self.alias_array = np.array(alias, dtype=np.int64)
+        if self.values is not None:
+            self.values_array = np.array(self.values)
+    def get_index(self):
+        return self.buffer.get_sample()
+    def get_indexes(self, n):
+        i = self.streams.generator.integers(0, len(self.prob_array), n)
+        return np.where(self.streams.generator.random(n) < self.prob_array[i], i, self.alias_array[i])
+    def get_sample(self):
+        if self.values is None:
+            return self.get_index()
+        return self.values[self.get_index()]
+    def get_samples(self, n):
+        if self.values is None:
+            return self.get_indexes(n)
+        return self.values_array[self.get_indexes(n)]
+
+def get_zipf_weights(exponent, count):
+    return (1.0 / np.arange(1, count+1, dtype=float) ** exponent).tolist()
+
+class DistZipf(DistDiscrete): # Zipf distribution over the indexes 0 to count-1, or over all the non-negative integers
+    def __init__(self, exponent, count, streams):
+        self.exponent = exponent
+        self.count = count
+        self.streams = streams
+        if count is None:
+            # the exponent is only checked when sampling, as a cardinality_distribution gets its count from the dimension
+            self.values = None
+            self.buffer = SampleBuffer(self.draw, streams)
+        else:
+            super().__init__(get_zipf_weights(exponent, count), None, streams)
+    def __str__(self):
+        return 'DistZipf(exponent='+str(self.exponent)+', count='+str(self.count)+')'
+    def draw(self, n):
+        if self.exponent <= 1:
+            msg = 'Error: Zipf distribution without a count requires an exponent greater than 1'
+            raise Exception(msg)
+        return self.streams.generator.zipf(self.exponent, n) - 1
+    def get_sample(self):
+        if self.count is None:
+            return self.buffer.get_sample()
+        return super().get_sample()
+    def get_samples(self, n):
+        if self.count is None:
+            return self.draw(n)
+        return super().get_samples(n)
+
+class DistPareto:
+    def __init__(self, shape, scale, streams):
+        self.streams = streams
+        self.shape = shape
+        self.scale = scale
+        self.buffer = SampleBuffer(self.get_samples, streams)
+    def __str__(self):
+        return 'DistPareto(shape='+str(self.shape)+', scale='+str(self.scale)+')'
+    def get_sample(self):
+        return self.buffer.get_sample()
+    def get_samples(self, n):
+        # numpy draws the Lomax form, shifting it by one gives the classical Pareto starting at scale
+        return (self.streams.generator.pareto(self.shape, n) + 1) * self.scale
+
+class DistLognormal:
+    def __init__(self, mu, sigma, streams):
+        self.streams = streams
+        self.mu = mu
+        self.sigma = sigma
+        self.buffer = SampleBuffer(self.get_samples, streams)
+    def __str__(self):
+        return 'DistLognormal(mu='+str(self.mu)+', sigma='+str(self.sigma)+')'
+    def get_sample(self):
+        return self.buffer.get_sample()
+    def get_samples(self, n):
+        return self.streams.generator.lognormal(self.mu, self.sigma, n)
+
+class DistScaled: # Stretches another distribution, used to slow down the spawning in each worker process
+    def __init__(self, dist, factor):
+        self.dist = dist
+        self.factor = factor
+    def __str__(self):
+        return 'DistScaled(dist='+str(self.dist)+', factor='+str(self.factor)+')'
+    def get_sample(self):
+        return self.dist.get_sample() * self.factor
+    def get_samples(self, n):
+        return self.dist.get_samples(n) * self.factor
 
-def parse_distribution(desc):
+def parse_distribution(desc, streams):
     dist_type = desc['type'].lower()
     dist_gen = None
     if dist_type == 'constant':
@@ -298,20 +944,45 @@ def parse_distribution(desc):
     elif dist_type == 'uniform':
         min_value = desc['min']
         max_value = desc['max']
-        dist_gen = DistUniform(min_value, max_value)
+        dist_gen = DistUniform(min_value, max_value, streams)
     elif dist_type == 'exponential':
         mean = desc['mean']
-        dist_gen = DistExponential(mean)
+        dist_gen = DistExponential(mean, streams)
     elif dist_type == 'normal':
         mean = desc['mean']
         stddev = desc['stddev']
-        dist_gen = DistNormal(mean, stddev)
+        dist_gen = DistNormal(mean, stddev, streams)
+    elif dist_type == 'weighted':
+        weights = desc['weights']
+        if 'values' in desc.keys():
+            values = desc['values']
+        else:
+            values = None
+        dist_gen = DistDiscrete(weights, values, streams)
+    elif dist_type == 'zipf':
+        exponent = desc['exponent']
+        if 'count' in desc.keys():
+            count = desc['count']
+        else:
+            count = None
+        dist_gen = DistZipf(exponent, count, streams)
+    elif dist_type == 'pareto':
+        shape = desc['shape']
+        if 'scale' in desc.keys():
+            scale = desc['scale']
+        else:
+            scale = 1.0
+        dist_gen = DistPareto(shape, scale, streams)
+    elif dist_type == 'lognormal':
+        mu = desc['mu']
+        sigma = desc['sigma']
+        dist_gen = DistLognormal(mu, sigma, streams)
     else:
         print('Error: Unknown distribution "'+dist_type+'"')
         exit()
     return dist_gen
 
-def parse_timestamp_distribution(desc):
+def parse_timestamp_distribution(desc, streams):
     dist_type = desc['type'].lower()
     dist_gen = None
     if dist_type == 'constant':
@@ -320,14 +991,14 @@ def parse_timestamp_distribution(desc):
     elif dist_type == 'uniform':
         min_value = dateutil.parser.isoparse(desc['min']).timestamp()
         max_value = dateutil.parser.isoparse(desc['max']).timestamp()
-        dist_gen = DistUniform(min_value, max_value)
+        dist_gen = DistUniform(min_value, max_value, streams)
     elif dist_type == 'exponential':
         mean = dateutil.parser.isoparse(desc['mean']).timestamp()
-        dist_gen = DistExponential(mean)
+        dist_gen = DistExponential(mean, streams)
     elif dist_type == 'normal':
         mean = desc[dateutil.parser.isoparse(desc['mean']).timestamp()]
         stddev = desc['stddev']
-        dist_gen = DistNormal(mean, stddev)
+        dist_gen = DistNormal(mean, stddev, streams)
     else:
         print('Error: Unknown distribution "'+dist_type+'"')
         exit()
@@ -342,10 +1013,79 @@ def parse_timestamp_distribution(desc):
 # field object based on the dimension configuration.
 # The get_stochastic_value() method is like a private method used to get a random
 # idividual value.
+# In batch mode, the get_json_field_strings() method produces the JSON dimension
+# field objects for n records at once using NumPy array draws. Fields that are
+# missing from a record are returned as None.
 #
 
+def get_batch_mask(probability, n, generator):
+    if probability <= 0.0:
+        return None
+    return generator.random(n) < probability
+
+def get_batch_indexes(distribution, n, length):
+    # same truncation and clamping as the per-record index lookups
+    return np.clip(distribution.get_samples(n), 0, length-1).astype(np.int64).tolist()
+
+def apply_batch_masks(fields, name, percent_nulls, percent_missing, generator):
+    n = len(fields)
+    nulls = get_batch_mask(percent_nulls, n, generator)
+    if nulls is not None:
+        null_string = '"'+name+'": null'
+        for i in np.flatnonzero(nulls).tolist():
+            fields[i] = null_string
+    missing = get_batch_mask(percent_missing, n, generator)
+    if missing is not None:
+        for i in np.flatnonzero(missing).tolist():
+            fields[i] = None
+    return fields
+
+def get_unique_values(name, cardinality, get_values):
+    # draws values in blocks and keeps the first occurrence of each, the set makes each membership test O(1)
+    values = []
+    seen = set()
+    misses = 0
+    while len(values) < cardinality:
+        # blocks don't shrink below a minimum so the last few values don't take a call each
+        block = get_values(max(cardinality - len(values), min(cardinality, 1024)))
+        fresh = list(itertools.filterfalse(seen.__contains__, dict.fromkeys(block)))[:cardinality - len(values)]
+        seen.update(fresh)
+        values.extend(fresh)
+        if len(fresh) == 0:
+            misses += len(block)
+        else:
+            misses = 0
+        # a distribution that keeps repeating itself for this long cannot produce enough distinct values
+        if misses > 20 * cardinality + 1000:
+            msg = 'Error: Element '+name+' specifies a cardinality of '+str(cardinality)+' but its distribution only produced '+str(len(values))+' distinct values'
+            raise Exception(msg)
+    return values
+
+def bind_cardinality_distribution(element):
+    # a zipf distribution without a count ranges over the whole list of values
+    if isinstance(element.cardinality_distribution, DistZipf) and element.cardinality_distribution.count is None:
+        element.cardinality_distribution = DistZipf(element.cardinality_distribution.exponent, len(element.cardinality), element.streams)
+    # a discrete distribution picks the index of a value, so it cannot have values of its own
+    if isinstance(element.cardinality_distribution, DistDiscrete) and element.cardinality_distribution.values is not None:
+        msg = 'Error: Element '+element.name+' has a weighted cardinality distribution with values, a cardinality distribution picks the index of a value so it only takes weights'
+        raise Exception(msg)
+    # nor more outcomes than there are values
+    if isinstance(element.cardinality_distribution, DistDiscrete):
+        if len(element.cardinality_distribution) > len(element.cardinality):
+            msg = 'Error: Element '+element.name+' has '+str(len(element.cardinality))+' values but its cardinality distribution has '+str(len(element.cardinality_distribution))+' outcomes'
+            raise Exception(msg)
+
+def get_cardinality_index(element):
+    index = int(element.cardinality_distribution.get_sample())
+    if index < 0:
+        index = 0
+    if index >= len(element.cardinality):
+        index = len(element.cardinality)-1
+    return index
+
 class ElementNow: # The time dimension
     def __init__(self, global_clock):
+        self.name = 'time'
         self.global_clock = global_clock
     def __str__(self):
         return 'ElementNow()'
@@ -353,8 +1093,13 @@ class ElementNow: # The time dimension
         now = self.global_clock.now().isoformat()[:-3]
         return '"time":"'+now+'"'
 
+    def get_value(self):
+        return self.global_clock.now()
+
 class ElementCounter: # The time dimension
-    def __init__(self, desc):
+    def __init__(self, desc, streams):
+        self.streams = streams
+        self.random = streams.random
         self.name = desc['name']
         if 'percent_nulls' in desc.keys():
             self.percent_nulls = desc['percent_nulls'] / 100.0
@@ -373,6 +1118,7 @@ class ElementCounter: # The time dimension
         else:
             self.increment = 1
         self.value = self.start
+        self.null_field = '"'+self.name+'": null'
     def __str__(self):
         s = 'ElementCounter(name='+self.name
         if self.start != 0:
@@ -387,19 +1133,39 @@ class ElementCounter: # The time dimension
         self.value += self.increment
         return v
 
+    def set_shard(self, index, count):
+        # interleave the counter values across the worker processes so they stay unique
+        self.value = self.start + index * self.increment
+        self.increment = self.increment * count
+
     def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
+        if self.random.random() < self.percent_nulls:
+            s = self.null_field
         else:
             s = '"'+self.name+'":"'+str(self.get_stochastic_value())+'"'
-            return s
+        return s
+
+    def get_value(self):
+        if self.random.random() < self.percent_nulls:
+            return None
+        return str(self.get_stochastic_value())
+
+    def get_json_field_strings(self, n):
+        fields = apply_batch_masks([''] * n, self.name, self.percent_nulls, self.percent_missing, self.streams.generator)
+        # the counter only advances for the records that actually carry a value
+        for i in range(n):
+            if fields[i] == '':
+                fields[i] = '"'+self.name+'":"'+str(self.get_stochastic_value())+'"'
+        return fields
 
     def is_missing(self):
-        return random.random() < self.percent_missing
+        return self.random.random() < self.percent_missing
 
 
 class ElementEnum: # enumeration dimensions
-    def __init__(self, desc):
+    def __init__(self, desc, streams):
+        self.streams = streams
+        self.random = streams.random
         self.name = desc['name']
         if 'percent_nulls' in desc.keys():
             self.percent_nulls = desc['percent_nulls'] / 100.0
@@ -413,31 +1179,40 @@ class ElementEnum: # enumeration dimensions
         if 'cardinality_distribution' not in desc.keys():
             print('Element '+self.name+' specifies a cardinality without a cardinality distribution')
             exit()
-        self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'])
+        self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'], streams)
+        bind_cardinality_distribution(self)
+        # the JSON fields are rendered once for each value
+        self.cardinality_fields = ['"'+self.name+'":"'+str(value)+'"' for value in self.cardinality]
+        self.null_field = '"'+self.name+'": null'
 
     def __str__(self):
         return 'ElementEnum(name='+self.name+', cardinality='+str(self.cardinality)+', cardinality_distribution='+str(self.cardinality_distribution)+')'
 
     def get_stochastic_value(self):
-        index = int(self.cardinality_distribution.get_sample())
-        if index < 0:
-            index = 0
-        if index >= len(self.cardinality):
-            index = len(self.cardinality)-1
-        return self.cardinality[index]
+        return self.cardinality[get_cardinality_index(self)]
 
     def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
-        else:
-            s = '"'+self.name+'":"'+str(self.get_stochastic_value())+'"'
-        return s
+        if self.random.random() < self.percent_nulls:
+            return self.null_field
+        return self.cardinality_fields[get_cardinality_index(self)]
+
+    def get_value(self):
+        if self.random.random() < self.percent_nulls:
+            return None
+        return str(self.get_stochastic_value())
+
+    def get_json_field_strings(self, n):
+        indexes = get_batch_indexes(self.cardinality_distribution, n, len(self.cardinality))
+        fields = [self.cardinality_fields[i] for i in indexes]
+        return apply_batch_masks(fields, self.name, self.percent_nulls, self.percent_missing, self.streams.generator)
 
     def is_missing(self):
-        return random.random() < self.percent_missing
+        return self.random.random() < self.percent_missing
 
 class ElementVariable: # Variable dimensions
-    def __init__(self, desc):
+    def __init__(self, desc, streams):
+        self.streams = streams
+        self.random = streams.random
         self.name = desc['name']
         self.variable_name = desc['variable']
 
@@ -448,9 +1223,14 @@ class ElementVariable: # Variable dimensions
         value = variables[self.variable_name]
         return '"'+self.name+'":"'+str(value)+'"'
 
+    def get_value(self, variables):
+        return str(variables[self.variable_name])
+
 
 class ElementBase: # Base class for the remainder of the dimensions
-    def __init__(self, desc):
+    def __init__(self, desc, streams):
+        self.streams = streams
+        self.random = streams.random
         self.name = desc['name']
         if 'percent_nulls' in desc.keys():
             self.percent_nulls = desc['percent_nulls'] / 100.0
@@ -465,79 +1245,97 @@ class ElementBase: # Base class for the remainder of the dimensions
             self.cardinality = None
             self.cardinality_distribution = None
         else:
-            self.cardinality = []
             if 'cardinality_distribution' not in desc.keys():
                 print('Element '+self.name+' specifies a cardinality without a cardinality distribution')
                 exit()
-            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'])
-            for i in range(cardinality):
-                Value = None
-                while True:
-                    value = self.get_stochastic_value()
-                    if value not in self.cardinality:
-                        break
-                self.cardinality.append(value)
-
+            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'], streams)
+            self.cardinality = get_unique_values(self.name, cardinality, self.get_stochastic_values)
+        self.set_cardinality_fields()
+
+    def set_cardinality_fields(self):
+        # the JSON fields of bounded elements are rendered once, so generating one is a lookup
+        self.null_field = '"'+self.name+'": null'
+        if self.cardinality is None:
+            self.cardinality_fields = None
+        else:
+            bind_cardinality_distribution(self)
+            prefix = '"'+self.name+'":'
+            self.cardinality_fields = [prefix+self.get_value_string(value) for value in self.cardinality]
 
     def get_stochastic_value(self):
         pass
 
+    def get_stochastic_values(self, n):
+        return [self.get_stochastic_value() for i in range(n)]
+
+    def get_value_string(self, value):
+        return str(value)
+
+    def get_typed_value(self, value):
+        return value
+
+    def get_value(self):
+        if self.random.random() < self.percent_nulls:
+            return None
+        if self.cardinality is None:
+            value = self.get_stochastic_value()
+        else:
+            value = self.cardinality[get_cardinality_index(self)]
+        return self.get_typed_value(value)
+
     def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
+        if self.random.random() < self.percent_nulls:
+            return self.null_field
+        if self.cardinality is None:
+            return '"'+self.name+'":'+self.get_value_string(self.get_stochastic_value())
+        return self.cardinality_fields[get_cardinality_index(self)]
+
+    def get_json_field_strings(self, n):
+        if self.cardinality is None:
+            prefix = '"'+self.name+'":'
+            fields = [prefix+self.get_value_string(value) for value in self.get_stochastic_values(n)]
         else:
-            if self.cardinality is None:
-                value = self.get_stochastic_value()
-            else:
-                index = int(self.cardinality_distribution.get_sample())
-                if index < 0:
-                    index = 0
-                if index >= len(self.cardinality):
-                    index = len(self.cardinality)-1
-                value = self.cardinality[index]
-            s = '"'+self.name+'":'+str(value)
-        return s
+            fields = [self.cardinality_fields[i] for i in get_batch_indexes(self.cardinality_distribution, n, len(self.cardinality))]
+        return apply_batch_masks(fields, self.name, self.percent_nulls, self.percent_missing, self.streams.generator)
 
     def is_missing(self):
-        return random.random() < self.percent_missing
+        return self.random.random() < self.percent_missing
 
 
 class ElementString(ElementBase):
-    def __init__(self, desc):
-        self.length_distribution = parse_distribution(desc['length_distribution'])
+    def __init__(self, desc, streams):
+        self.length_distribution = parse_distribution(desc['length_distribution'], streams)
         if 'chars' in desc:
             self.chars = desc['chars']
         else:
             self.chars = string.printable
-        super().__init__(desc)
+        super().__init__(desc, streams)
 
     def __str__(self):
         return 'ElementString(name='+self.name+', cardinality='+str(self.cardinality)+', cardinality_distribution='+str(self.cardinality_distribution)+', chars='+self.chars+')'
 
     def get_stochastic_value(self):
         length = int(self.length_distribution.get_sample())
-        return ''.join(random.choices(list(self.chars), k=length))
-
-    def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
-        else:
-            if self.cardinality is None:
-                value = self.get_stochastic_value()
-            else:
-                index = int(self.cardinality_distribution.get_sample())
-                if index < 0:
-                    index = 0
-                if index >= len(self.cardinality):
-                    index = len(self.cardinality)-1
-                value = self.cardinality[index]
-            s = '"'+self.name+'":"'+str(value)+'"'
-        return s
+        return ''.join(self.random.choices(list(self.chars), k=length))
+
+    def get_stochastic_values(self, n):
+        lengths = np.maximum(self.length_distribution.get_samples(n).astype(np.int64), 0)
+        ends = np.cumsum(lengths).tolist()
+        chars = [self.chars[i] for i in self.streams.generator.integers(0, len(self.chars), ends[-1] if n > 0 else 0).tolist()]
+        values = []
+        start = 0
+        for end in ends:
+            values.append(''.join(chars[start:end]))
+            start = end
+        return values
+
+    def get_value_string(self, value):
+        return '"'+str(value)+'"'
 
 class ElementInt(ElementBase):
-    def __init__(self, desc):
-        self.value_distribution = parse_distribution(desc['distribution'])
-        super().__init__(desc)
+    def __init__(self, desc, streams):
+        self.value_distribution = parse_distribution(desc['distribution'], streams)
+        super().__init__(desc, streams)
 
     def __str__(self):
         return 'ElementInt(name='+self.name+', value_distribution='+str(self.value_distribution)+', cardinality='+str(self.cardinality)+', cardinality_distribution='+str(self.cardinality_distribution)+')'
@@ -545,14 +1343,18 @@ class ElementInt(ElementBase):
     def get_stochastic_value(self):
         return int(self.value_distribution.get_sample())
 
+    def get_stochastic_values(self, n):
+        return self.value_distribution.get_samples(n).astype(np.int64).tolist()
+
 class ElementFloat(ElementBase):
-    def __init__(self, desc):
-        self.value_distribution = parse_distribution(desc['distribution'])
+    def __init__(self, desc, streams):
+        self.value_distribution = parse_distribution(desc['distribution'], streams)
         if 'precision' in desc:
             self.precision = desc['precision']
+            self.format = '%.'+str(self.precision)+'f'
         else:
             self.precision = None
-        super().__init__(desc)
+        super().__init__(desc, streams)
 
     def __str__(self):
         return 'ElementFloat(name='+self.name+', value_distribution='+str(self.value_distribution)+', cardinality='+str(self.cardinality)+', cardinality_distribution='+str(self.cardinality_distribution)+')'
@@ -560,30 +1362,25 @@ class ElementFloat(ElementBase):
     def get_stochastic_value(self):
         return float(self.value_distribution.get_sample())
 
-    def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
-        else:
-            if self.cardinality is None:
-                value = self.get_stochastic_value()
-            else:
-                index = int(self.cardinality_distribution.get_sample())
-                if index < 0:
-                    index = 0
-                if index >= len(self.cardinality):
-                    index = len(self.cardinality)-1
-                value = self.cardinality[index]
-            if self.precision is None:
-                s = '"'+self.name+'":'+str(value)
-            else:
-                format = '%.'+str(self.precision)+'f'
-                s = '"'+self.name+'":'+str(format%value)
-        return s
+    def get_stochastic_values(self, n):
+        return self.value_distribution.get_samples(n).astype(float).tolist()
+
+    def get_value_string(self, value):
+        if self.precision is None:
+            return str(value)
+        return self.format % value
+
+    def get_typed_value(self, value):
+        if self.precision is None:
+            return value
+        return round(value, self.precision)
 
 class ElementTimestamp(ElementBase):
-    def __init__(self, desc):
+    def __init__(self, desc, streams):
+        self.streams = streams
+        self.random = streams.random
         self.name = desc['name']
-        self.value_distribution = parse_timestamp_distribution(desc['distribution'])
+        self.value_distribution = parse_timestamp_distribution(desc['distribution'], streams)
         if 'percent_nulls' in desc.keys():
             self.percent_nulls = desc['percent_nulls'] / 100.0
         else:
@@ -600,15 +1397,9 @@ class ElementTimestamp(ElementBase):
             if 'cardinality_distribution' not in desc.keys():
                 msg = 'Element '+self.name+' specifies a cardinality without a cardinality distribution'
                 raise Exception(msg)
-            self.cardinality = []
-            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'])
-            for i in range(cardinality):
-                Value = None
-                while True:
-                    value = self.get_stochastic_value()
-                    if value not in self.cardinality:
-                        break
-                self.cardinality.append(value)
+            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'], streams)
+            self.cardinality = get_unique_values(self.name, cardinality, self.get_stochastic_values)
+        self.set_cardinality_fields()
 
     def __str__(self):
         return 'ElementTimestamp(name='+self.name+', value_distribution='+str(self.value_distribution)+', cardinality='+str(self.cardinality)+', cardinality_distribution='+str(self.cardinality_distribution)+')'
@@ -616,29 +1407,22 @@ class ElementTimestamp(ElementBase):
     def get_stochastic_value(self):
         return datetime.fromtimestamp(self.value_distribution.get_sample()).isoformat()[:-3]
 
-    def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
-        else:
-            if self.cardinality is None:
-                value = self.get_stochastic_value()
-            else:
-                index = int(self.cardinality_distribution.get_sample())
-                if index < 0:
-                    index = 0
-                if index >= len(self.cardinality):
-                    index = len(self.cardinality)-1
-                value = self.cardinality[index]
-            s = '"'+self.name+'":"'+str(value)+'"'
-        return s
+    def get_stochastic_values(self, n):
+        return [datetime.fromtimestamp(t).isoformat()[:-3] for t in self.value_distribution.get_samples(n).tolist()]
+
+    def get_value_string(self, value):
+        return '"'+str(value)+'"'
+
+    def get_typed_value(self, value):
+        return datetime.fromisoformat(value)
 
     def is_missing(self):
-        return random.random() < self.percent_missing
+        return self.random.random() < self.percent_missing
 
 class ElementIPAddress(ElementBase):
-    def __init__(self, desc):
-        self.value_distribution = parse_distribution(desc['distribution'])
-        super().__init__(desc)
+    def __init__(self, desc, streams):
+        self.value_distribution = parse_distribution(desc['distribution'], streams)
+        super().__init__(desc, streams)
 
     def __str__(self):
         return 'ElementIPAddress(name='+self.name+', value_distribution='+str(self.value_distribution)+', cardinality='+str(self.cardinality)+', cardinality_distribution='+str(self.cardinality_distribution)+')'
@@ -647,26 +1431,20 @@ class ElementIPAddress(ElementBase):
         value = int(self.value_distribution.get_sample())
         return str((value & 0xFF000000) >> 24)+'.'+str((value & 0x00FF0000) >> 16)+'.'+str((value & 0x0000FF00) >> 8)+'.'+str(value & 0x000000FF)
 
-    def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
-        else:
-            if self.cardinality is None:
-                value = self.get_stochastic_value()
-            else:
-                index = int(self.cardinality_distribution.get_sample())
-                if index < 0:
-                    index = 0
-                if index >= len(self.cardinality):
-                    index = len(self.cardinality)-1
-                value = self.cardinality[index]
-            s = '"'+self.name+'":"'+str(value)+'"'
-        return s
+    def get_stochastic_values(self, n):
+        values = self.value_distribution.get_samples(n).astype(np.int64)
+        octets = zip(((values & 0xFF000000) >> 24).tolist(), ((values & 0x00FF0000) >> 16).tolist(), ((values & 0x0000FF00) >> 8).tolist(), (values & 0x000000FF).tolist())
+        return [str(a)+'.'+str(b)+'.'+str(c)+'.'+str(d) for a, b, c, d in octets]
+
+    def get_value_string(self, value):
+        return '"'+str(value)+'"'
 
 class ElementObject():
-    def __init__(self, desc):
+    def __init__(self, desc, streams):
+        self.streams = streams
+        self.random = streams.random
         self.name = desc['name']
-        self.dimensions = get_variables(desc['dimensions'])
+        self.dimensions = get_variables(desc['dimensions'], streams)
         if 'percent_nulls' in desc.keys():
             self.percent_nulls = desc['percent_nulls'] / 100.0
         else:
@@ -680,18 +1458,15 @@ class ElementObject():
             self.cardinality = None
             self.cardinality_distribution = None
         else:
-            self.cardinality = []
             if 'cardinality_distribution' not in desc.keys():
                 msg = 'Element '+self.name+' specifies a cardinality without a cardinality distribution'
                 raise Exception(msg)
-            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'])
-            for i in range(cardinality):
-                Value = None
-                while True:
-                    value = self.get_instance()
-                    if value not in self.cardinality:
-                        break
-                self.cardinality.append(value)
+            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'], streams)
+            self.cardinality = get_unique_values(self.name, cardinality, self.get_instances)
+            bind_cardinality_distribution(self)
+        # the cardinality already holds the rendered JSON fields
+        self.cardinality_fields = self.cardinality
+        self.null_field = '"'+self.name+'": null'
 
     def __str__(self):
         s = 'ElementObject(name='+self.name+', dimensions=['
@@ -700,6 +1475,9 @@ class ElementObject():
         s += '])'
         return s
 
+    def get_instances(self, n):
+        return [self.get_instance() for i in range(n)]
+
     def get_instance(self):
         s = '"'+self.name+'": {'
         for e in self.dimensions:
@@ -707,31 +1485,42 @@ class ElementObject():
         s = s[:-1] +  '}'
         return s
 
+    def get_instance_value(self):
+        return {e.name: e.get_value() for e in self.dimensions}
+
+    def get_value(self):
+        if self.random.random() < self.percent_nulls:
+            return None
+        if self.cardinality is None:
+            return self.get_instance_value()
+        return get_cardinality_values(self)[get_cardinality_index(self)]
+
 
     def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
+        if self.random.random() < self.percent_nulls:
+            return self.null_field
+        if self.cardinality is None:
+            return self.get_instance()
+        return self.cardinality_fields[get_cardinality_index(self)]
+
+    def get_json_field_strings(self, n):
+        if self.cardinality is None:
+            fields = self.get_instances(n)
         else:
-            if self.cardinality is None:
-                s = self.get_instance()
-            else:
-                index = int(self.cardinality_distribution.get_sample())
-                if index < 0:
-                    index = 0
-                if index >= len(self.cardinality):
-                    index = len(self.cardinality)-1
-                s = self.cardinality[index]
-        return s
+            fields = [self.cardinality_fields[i] for i in get_batch_indexes(self.cardinality_distribution, n, len(self.cardinality))]
+        return apply_batch_masks(fields, self.name, self.percent_nulls, self.percent_missing, self.streams.generator)
 
     def is_missing(self):
-        return random.random() < self.percent_missing
+        return self.random.random() < self.percent_missing
 
 class ElementList():
-    def __init__(self, desc):
+    def __init__(self, desc, streams):
+        self.streams = streams
+        self.random = streams.random
         self.name = desc['name']
-        self.elements = get_variables(desc['elements'])
-        self.length_distribution = parse_distribution(desc['length_distribution'])
-        self.selection_distribution = parse_distribution(desc['selection_distribution'])
+        self.elements = get_variables(desc['elements'], streams)
+        self.length_distribution = parse_distribution(desc['length_distribution'], streams)
+        self.selection_distribution = parse_distribution(desc['selection_distribution'], streams)
         if 'percent_nulls' in desc.keys():
             self.percent_nulls = desc['percent_nulls'] / 100.0
         else:
@@ -745,18 +1534,15 @@ class ElementList():
             self.cardinality = None
             self.cardinality_distribution = None
         else:
-            self.cardinality = []
             if 'cardinality_distribution' not in desc.keys():
                 msg = 'Element '+self.name+' specifies a cardinality without a cardinality distribution'
                 raise Exception(msg)
-            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'])
-            for i in range(cardinality):
-                Value = None
-                while True:
-                    value = self.get_instance()
-                    if value not in self.cardinality:
-                        break
-                self.cardinality.append(value)
+            self.cardinality_distribution = parse_distribution(desc['cardinality_distribution'], streams)
+            self.cardinality = get_unique_values(self.name, cardinality, self.get_instances)
+            bind_cardinality_distribution(self)
+        # the cardinality already holds the rendered JSON fields
+        self.cardinality_fields = self.cardinality
+        self.null_field = '"'+self.name+'": null'
 
     def __str__(self):
         s = 'ElementObject(name='+self.name
@@ -768,6 +1554,9 @@ class ElementList():
         s += '])'
         return s
 
+    def get_instances(self, n):
+        return [self.get_instance() for i in range(n)]
+
     def get_instance(self):
         s = '"'+self.name+'": ['
         length = int(self.length_distribution.get_sample())
@@ -781,66 +1570,334 @@ class ElementList():
         s = s[:-1] +  ']'
         return s
 
+    def get_instance_value(self):
+        length = int(self.length_distribution.get_sample())
+        values = []
+        for i in range(length):
+            index = int(self.selection_distribution.get_sample())
+            if index < 0:
+                index = 0
+            if index >= len(self.elements):
+                index = len(self.elements)-1
+            values.append(self.elements[index].get_value())
+        if get_list_item_element(self) is None:
+            values = [get_string_value(v) for v in values]
+        return values
+
+    def get_value(self):
+        if self.random.random() < self.percent_nulls:
+            return None
+        if self.cardinality is None:
+            return self.get_instance_value()
+        return get_cardinality_values(self)[get_cardinality_index(self)]
+
 
     def get_json_field_string(self):
-        if random.random() < self.percent_nulls:
-            s = '"'+self.name+'": null'
+        if self.random.random() < self.percent_nulls:
+            return self.null_field
+        if self.cardinality is None:
+            return self.get_instance()
+        return self.cardinality_fields[get_cardinality_index(self)]
+
+    def get_json_field_strings(self, n):
+        if self.cardinality is None:
+            fields = self.get_instances(n)
         else:
-            if self.cardinality is None:
-                s = self.get_instance()
-            else:
-                index = int(self.cardinality_distribution.get_sample())
-                if index < 0:
-                    index = 0
-                if index >= len(self.cardinality):
-                    index = len(self.cardinality)-1
-                s = self.cardinality[index]
-        return s
+            fields = [self.cardinality_fields[i] for i in get_batch_indexes(self.cardinality_distribution, n, len(self.cardinality))]
+        return apply_batch_masks(fields, self.name, self.percent_nulls, self.percent_missing, self.streams.generator)
 
     def is_missing(self):
-        return random.random() < self.percent_missing
+        return self.random.random() < self.percent_missing
 
 
-def parse_element(desc):
+def parse_element(desc, streams):
     if desc['type'].lower() == 'counter':
-        el = ElementCounter(desc)
+        el = ElementCounter(desc, streams)
     elif desc['type'].lower() == 'enum':
-        el = ElementEnum(desc)
+        el = ElementEnum(desc, streams)
     elif desc['type'].lower() == 'string':
-        el = ElementString(desc)
+        el = ElementString(desc, streams)
     elif desc['type'].lower() == 'int':
-        el = ElementInt(desc)
+        el = ElementInt(desc, streams)
     elif desc['type'].lower() == 'float':
-        el = ElementFloat(desc)
+        el = ElementFloat(desc, streams)
     elif desc['type'].lower() == 'timestamp':
-        el = ElementTimestamp(desc)
+        el = ElementTimestamp(desc, streams)
     elif desc['type'].lower() == 'ipaddress':
-        el = ElementIPAddress(desc)
+        el = ElementIPAddress(desc, streams)
     elif desc['type'].lower() == 'variable':
-        el = ElementVariable(desc)
+        el = ElementVariable(desc, streams)
     elif desc['type'].lower() == 'object':
-        el = ElementObject(desc)
+        el = ElementObject(desc, streams)
     elif desc['type'].lower() == 'list':
-        el = ElementList(desc)
+        el = ElementList(desc, streams)
     else:
         msg = 'Error: Unknown dimension type "'+desc['type']+'"'
         raise Exception(msg)
     return el
 
 
-def get_variables(desc):
+def get_variables(desc, streams):
     elements = []
     for element in desc:
-        el = parse_element(element)
+        el = parse_element(element, streams)
         elements.append(el)
     return elements
 
-def get_dimensions(desc, global_clock):
-    elements = get_variables(desc)
+def shard_counters(elements, index, count):
+    for element in elements:
+        if isinstance(element, ElementCounter):
+            element.set_shard(index, count)
+        elif isinstance(element, ElementObject):
+            shard_counters(element.dimensions, index, count)
+        elif isinstance(element, ElementList):
+            shard_counters(element.elements, index, count)
+
+def get_dimensions(desc, global_clock, streams):
+    elements = get_variables(desc, streams)
     elements.insert(0, ElementNow(global_clock))
     return elements
 
 
+#
+# Columnar targets receive the values of the fields instead of JSON. The column
+# type of each field comes from the type of its element.
+#
+
+def get_column_kind(element):
+    if isinstance(element, (ElementNow, ElementTimestamp)):
+        return 'timestamp'
+    elif isinstance(element, ElementInt):
+        return 'int'
+    elif isinstance(element, ElementFloat):
+        return 'float'
+    elif isinstance(element, ElementObject):
+        return 'object'
+    elif isinstance(element, ElementList):
+        return 'list'
+    return 'string'
+
+def get_list_item_element(element):
+    # lists of a single scalar column kind keep that kind, other lists hold strings
+    kinds = set([get_column_kind(e) for e in element.elements])
+    if len(kinds) == 1 and kinds.isdisjoint(['object', 'list']):
+        return element.elements[0]
+    return None
+
+def get_string_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()[:-3]
+    return json.dumps(value, default=str)
+
+def decode_json_value(element, value):
+    # converts a value decoded from the JSON rendered by an element to the element's column kind
+    if value is None:
+        return None
+    kind = get_column_kind(element)
+    if kind == 'timestamp':
+        return datetime.fromisoformat(value)
+    elif kind == 'object':
+        return {e.name: decode_json_value(e, value.get(e.name)) for e in element.dimensions}
+    elif kind == 'list':
+        item = get_list_item_element(element)
+        if item is None:
+            return [get_string_value(v) for v in value]
+        return [decode_json_value(item, v) for v in value]
+    elif kind == 'string':
+        return str(value)
+    return value
+
+def get_cardinality_values(element):
+    # objects and lists keep their cardinality as rendered JSON, the values are decoded once when first needed
+    if not hasattr(element, 'cardinality_values'):
+        element.cardinality_values = [decode_json_value(element, json.loads('{'+s+'}')[element.name]) for s in element.cardinality]
+    return element.cardinality_values
+
+def get_arrow_type(element, pa):
+    kind = get_column_kind(element)
+    if kind == 'timestamp':
+        return pa.timestamp('ms')
+    elif kind == 'int':
+        return pa.int64()
+    elif kind == 'float':
+        return pa.float64()
+    elif kind == 'object':
+        return pa.struct([(e.name, get_arrow_type(e, pa)) for e in element.dimensions])
+    elif kind == 'list':
+        item = get_list_item_element(element)
+        return pa.list_(pa.string() if item is None else get_arrow_type(item, pa))
+    return pa.string()
+
+
+#
+# Each emitter is compiled once into a function that renders its records. The
+# keys and separators are constant fragments of the generated source, a field
+# whose percent_nulls or percent_missing is zero draws nothing for it, and the
+# record is built by a single join.
+#
+
+class RecordTemplate:
+    def __init__(self, dimensions, streams, key_fields=[]):
+        self.dimensions = dimensions
+        self.key_fields = key_fields
+        # the Random of the job is only ever reseeded in place, so its bound method can be compiled in
+        self.namespace = {'_random': streams.random.random, 'get_field_value': get_field_value}
+        self.source = self.get_source()
+        exec(compile(self.source, '<emitter>', 'exec'), self.namespace)
+        self.create_record = self.namespace['create_record']
+
+    def __str__(self):
+        return 'RecordTemplate(dimensions='+str([str(d) for d in self.dimensions])+')'
+
+    def bind(self, name, value):
+        self.namespace[name] = value
+        return name
+
+    def get_expressions(self, parts):
+        # adjacent constant fragments are merged into one string literal
+        merged = []
+        for is_code, part in parts:
+            if not is_code and len(merged) > 0 and not merged[-1][0]:
+                merged[-1] = (False, merged[-1][1]+part)
+            else:
+                merged.append((is_code, part))
+        return [part if is_code else repr(part) for is_code, part in merged]
+
+    def get_null_source(self, element, i, parts):
+        # a field that may be null is a single expression
+        if element.percent_nulls <= 0.0:
+            return parts
+        value = ' + '.join(self.get_expressions(parts))
+        null_field = self.bind('_null_'+str(i), element.null_field)
+        return [(True, '('+null_field+' if _random() < '+repr(element.percent_nulls)+' else '+value+')')]
+
+    def get_field_parts(self, element, i):
+        # the rendered field as (is_code, part) pairs, in the same form as get_json_field_string
+        prefix = '"'+element.name+'":'
+        if isinstance(element, ElementNow):
+            clock = self.bind('_clock_'+str(i), element.global_clock)
+            return [(False, prefix+'"'), (True, clock+'.now().isoformat()[:-3]'), (False, '"')]
+        elif isinstance(element, ElementVariable):
+            return [(False, prefix+'"'), (True, 'str(variables['+repr(element.variable_name)+'])'), (False, '"')]
+        elif isinstance(element, ElementCounter):
+            value = self.bind('_value_'+str(i), element.get_stochastic_value)
+            return self.get_null_source(element, i, [(False, prefix+'"'), (True, 'str('+value+'())'), (False, '"')])
+        elif getattr(element, 'cardinality_fields', None) is not None:
+            # the same truncation and clamping as get_cardinality_index, comparisons are cheaper than calls to min() and max()
+            fields = self.bind('_fields_'+str(i), element.cardinality_fields)
+            sample = self.bind('_sample_'+str(i), element.cardinality_distribution.get_sample)
+            last = str(len(element.cardinality_fields)-1)
+            index = '_i if 0 <= (_i := int('+sample+'())) <= '+last+' else (0 if _i < 0 else '+last+')'
+            return self.get_null_source(element, i, [(True, fields+'['+index+']')])
+        elif isinstance(element, ElementBase):
+            value = self.bind('_value_'+str(i), element.get_stochastic_value)
+            value_string = self.bind('_string_'+str(i), element.get_value_string)
+            return self.get_null_source(element, i, [(False, prefix), (True, value_string+'('+value+'())')])
+        elif isinstance(element, (ElementObject, ElementList)):
+            instance = self.bind('_instance_'+str(i), element.get_instance)
+            return self.get_null_source(element, i, [(True, instance+'()')])
+        field = self.bind('_field_'+str(i), element.get_json_field_string)
+        return [(True, field+'()')]
+
+    def get_source(self):
+        lines = ['def create_record(variables, values=None):']
+        parts = [(False, '{')]
+        keys = []
+        for i, element in enumerate(self.dimensions):
+            field_parts = self.get_field_parts(element, i)
+            if element.name in self.key_fields:
+                # the value of a key field is parsed from its rendered field, as the target expects
+                key = '_key_'+str(i)
+                lines.append('    '+key+' = None')
+                keys.append((key, element.name))
+                field_parts = [(True, '('+key+' := '+' + '.join(self.get_expressions(field_parts))+')')]
+            # the separator goes with the field, so a missing field leaves nothing behind
+            if len(parts) > 1:
+                field_parts = [(False, ',')] + field_parts
+            percent_missing = getattr(element, 'percent_missing', 0.0)
+            if percent_missing > 0.0:
+                field = ' + '.join(self.get_expressions(field_parts))
+                field_parts = [(True, '('+field+' if _random() >= '+repr(percent_missing)+" else '')")]
+            parts.extend(field_parts)
+        parts.append((False, '}'))
+        lines.append("    record = ''.join(("+', '.join(self.get_expressions(parts))+'))')
+        if len(keys) > 0:
+            lines.append('    if values is not None:')
+            for key, name in keys:
+                lines.append('        if '+key+' is not None:')
+                lines.append('            values['+repr(name)+'] = get_field_value('+key+', '+repr(name)+')')
+        lines.append('    return record')
+        return '\n'.join(lines)+'\n'
+
+
+#
+# In batch mode the fields of an emitter are generated batch_size records at a
+# time. The time and variable dimensions depend on the moment the record is
+# emitted, so each buffered row holds the pre-rendered segments of fields that
+# sit between them.
+#
+
+class RecordBatch:
+    def __init__(self, dimensions, batch_size, key_fields=[]):
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.key_fields = key_fields
+        self.late_elements = [e for e in dimensions if isinstance(e, (ElementNow, ElementVariable))]
+        self.rows = collections.deque()
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return 'RecordBatch(batch_size='+str(self.batch_size)+', dimensions='+str([str(d) for d in self.dimensions])+')'
+
+    def fill(self):
+        columns = []
+        for element in self.dimensions:
+            if isinstance(element, (ElementNow, ElementVariable)):
+                columns.append(None)
+            else:
+                columns.append(element.get_json_field_strings(self.batch_size))
+        key_columns = [(e.name, c) for e, c in zip(self.dimensions, columns) if c is not None and e.name in self.key_fields]
+        for i in range(self.batch_size):
+            row = []
+            segment = []
+            for column in columns:
+                if column is None:
+                    row.append(','.join(segment))
+                    segment = []
+                elif column[i] is not None:
+                    segment.append(column[i])
+            row.append(','.join(segment))
+            values = None
+            if len(key_columns) > 0:
+                values = {name: get_field_value(column[i], name) for name, column in key_columns if column[i] is not None}
+            self.rows.append((row, values))
+
+    def get_row(self):
+        with self.lock:
+            if len(self.rows) == 0:
+                self.fill()
+            return self.rows.popleft()
+
+    def create_record(self, variables, values=None):
+        row, row_values = self.get_row()
+        fields = [row[0]] if row[0] else []
+        for i, element in enumerate(self.late_elements):
+            if isinstance(element, ElementVariable):
+                field = element.get_json_field_string(variables)
+            else:
+                field = element.get_json_field_string()
+            fields.append(field)
+            if values is not None and element.name in values:
+                values[element.name] = get_field_value(field, element.name)
+            if row[i+1]:
+                fields.append(row[i+1])
+        if values is not None and row_values is not None:
+            values.update(row_values)
+        return '{'+','.join(fields)+'}'
+
+
 #
 # Set up the state machine
 #
@@ -862,40 +1919,155 @@ def parse_transitions(desc):
     return transitions
 
 class State:
-    def __init__(self, name, dimensions, delay, transitions, variables):
+    def __init__(self, name, dimensions, delay, transitions, variables, template, streams, batch=None):
         self.name = name
         self.dimensions = dimensions
+        self.template = template
+        self.batch = batch
         self.delay = delay
         self.transistion_states = [t.next_state for t in transitions]
         self.transistion_probabilities = [t.probability for t in transitions]
+        if len(transitions) == 0:
+            msg = 'Error: State "'+name+'" has no transitions, use a transition to "stop" to end the session'
+            raise Exception(msg)
+        self.transition_distribution = DistDiscrete(self.transistion_probabilities, None, streams)
         self.variables = variables
 
     def __str__(self):
         return 'State(name='+self.name+', dimensions='+str([str(d) for d in self.dimensions])+', delay='+str(self.delay)+', transistion_states='+str(self.transistion_states)+', transistion_probabilities='+str(self.transistion_probabilities)+'variables='+str([str(v) for v in self.variables])+')'
 
     def get_next_state_name(self):
-        return random.choices(self.transistion_states, weights=self.transistion_probabilities, k=1)[0]
+        return self.transistion_states[self.transition_distribution.get_index()]
+
+#
+# Discrete-event simulation
+# In simulated time the entities are plain records holding their position in the
+# state machine. The scheduler keeps a heap of (time, sequence, entity) tuples and
+# advances the clock to each event in turn, so no threads are needed.
+#
+
+class Entity:
+    __slots__ = ('name', 'state', 'variables')
+    def __init__(self, name, state):
+        self.name = name
+        self.state = state
+        self.variables = {}
+    def __str__(self):
+        return 'Entity(name='+self.name+', state='+(self.state.name if self.state is not None else 'None')+')'
+
+class EventScheduler:
+    def __init__(self, global_clock):
+        self.global_clock = global_clock
+        self.events = []
+        self.sequence = itertools.count() # keeps events at the same time in FIFO order
+    def __str__(self):
+        return 'EventScheduler(time='+str(self.global_clock.now())+', events='+str(len(self.events))+')'
+    def __len__(self):
+        return len(self.events)
+    def schedule(self, delta, entity):
+        # cannot travel to the past so don't move the time if delta is negative
+        if delta < 0:
+            delta = 0.0
+        heapq.heappush(self.events, (self.global_clock.now() + timedelta(seconds=delta), next(self.sequence), entity))
+    def next_entity(self):
+        if len(self.events) == 0:
+            return None
+        t, seq, entity = heapq.heappop(self.events)
+        self.global_clock.advance(t)
+        return entity
+
+class TickScheduler(EventScheduler): # Paces the entities in real time, waking once per tick
+    def __init__(self, global_clock, tick=0.005):
+        super().__init__(global_clock)
+        self.tick = tick
+        self.tick_time = datetime.now()
+        self.current = None # the time the event being run was due
+        self.ticks = 0
+        # the pacing error is how late the events were emitted
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+    def __str__(self):
+        return 'TickScheduler(tick='+str(self.tick)+', events='+str(len(self.events))+')'
+    def schedule(self, delta, entity):
+        # the next event is due a delay after this one was due, not after it ran, so lateness doesn't accumulate
+        if delta < 0:
+            delta = 0.0
+        base = self.current if self.current is not None else datetime.now()
+        heapq.heappush(self.events, (base + timedelta(seconds=delta), next(self.sequence), entity))
+    def next_entity(self):
+        if len(self.events) == 0:
+            return None
+        t = self.events[0][0]
+        if t > self.tick_time:
+            self.tick_time = datetime.now()
+            if t > self.tick_time:
+                # sleep for at least a tick, the events that fall due meanwhile are all emitted on the next wakeup
+                wait = max((t - self.tick_time).total_seconds(), self.tick)
+                if self.global_clock.wakeup.wait(wait):
+                    return None # the job was stopped
+                self.tick_time = datetime.now()
+                self.ticks += 1
+        t, seq, entity = heapq.heappop(self.events)
+        self.current = t
+        lag = (self.tick_time - t).total_seconds()
+        self.lag_count += 1
+        self.lag_total += lag
+        if lag > self.lag_max:
+            self.lag_max = lag
+        return entity
+    def get_pacing_error(self):
+        mean = self.lag_total / self.lag_count if self.lag_count > 0 else 0.0
+        return {'ticks': self.ticks, 'mean_lag': round(mean, 6), 'max_lag': round(self.lag_max, 6)}
+
+class RecordCounter: # The records emitted by one thread, and the records it has reserved from the budget
+    __slots__ = ('records', 'bytes', 'reserved')
+    def __init__(self):
+        self.records = 0
+        self.bytes = 0
+        self.reserved = 0
+
+class ShardCounts: # The records and bytes emitted by each worker process, published while the processes run
+    def __init__(self, context, workers, interval=1.0):
+        # each process only writes its own slots, so the array doesn't need a lock
+        self.counts = context.Array('q', 2 * workers, lock=False)
+        self.interval = interval
+    def __str__(self):
+        return 'ShardCounts(workers='+str(len(self.counts) // 2)+')'
+    def publish(self, index, sim_control):
+        self.counts[2 * index] = sim_control.get_record_count()
+        self.counts[2 * index + 1] = sim_control.get_byte_count()
+    def publish_thread(self, index, sim_control, stop):
+        while not stop.wait(self.interval):
+            self.publish(index, sim_control)
+    def get_record_count(self):
+        return sum(self.counts[0::2])
+    def get_byte_count(self):
+        return sum(self.counts[1::2])
 
 class SimEnd:
-    def __init__(self, total_recs, runtime, global_clock):
+    def __init__(self, total_recs, runtime, global_clock, shared_count=None, block_size=256):
         self.lock = threading.Lock()
         self.thread_end_event = threading.Event()
         self.total_recs = total_recs
-        self.record_count = 0
+        # each thread counts its records in its own counter, the totals are only added up when they are read
+        self.local = threading.local()
+        self.counters = []
+        self.ended_records = 0 # the counts of the threads that have ended, whose counters are dropped
+        self.ended_bytes = 0
+        self.claimed = 0 # records reserved by the threads of this process
+        self.shared_count = shared_count # records reserved by all the worker processes
+        self.block_size = block_size
+        self.terminated = False
+        self.shard_counts = None # the counts of the worker processes that write on their own
         self.global_clock = global_clock
         self.entity_count = 0
         if runtime is None:
             self.t = None
+            self.end_time = None
         else:
-            if runtime[-1].lower() == 's':
-                self.t = int(runtime[:-1])
-            elif runtime[-1].lower() == 'm':
-                self.t = int(runtime[:-1]) * 60
-            elif runtime[-1].lower() == 'h':
-                self.t = int(runtime[:-1]) * 60 * 60
-            else:
-                msg = 'Error: Unknown runtime value"'+runtime+'"'
-                raise Exception(msg)
+            self.t = parse_duration(runtime)
+            self.end_time = global_clock.get_start_time() + timedelta(seconds=self.t)
 
     def get_entity_count(self):
         return self.entity_count
@@ -910,16 +2082,95 @@ class SimEnd:
         self.entity_count -=1
         self.lock.release()
 
-    def inc_rec_count(self):
-        self.lock.acquire()
-        self.record_count += 1
-        self.lock.release()
-        if (self.total_recs is not None) and (self.record_count >= self.total_recs):
-            self.thread_end_event.set()
+    def get_counter(self):
+        try:
+            return self.local.counter
+        except AttributeError:
+            counter = RecordCounter()
+            self.local.counter = counter
+            with self.lock:
+                self.counters.append(counter)
+            return counter
+
+    def reserve_records(self):
+        # takes a block of records from the -n budget, blocks are only larger than one record when a single thread claims them
+        budget_lock = self.lock if self.shared_count is None else self.shared_count.get_lock()
+        with budget_lock:
+            reserved = self.claimed if self.shared_count is None else self.shared_count.value
+            remaining = self.total_recs - reserved
+            if remaining <= 0:
+                self.thread_end_event.set()
+                return 0
+            n = min(self.block_size, remaining)
+            if self.shared_count is not None:
+                self.shared_count.value += n
+                with self.lock:
+                    self.claimed += n
+            else:
+                self.claimed += n
+        return n
+
+    def claim_record(self):
+        # a record may only be emitted once it is claimed from the budget, so the -n limit is exact
+        if self.total_recs is None:
+            return True
+        counter = self.get_counter()
+        if counter.reserved == 0:
+            counter.reserved = self.reserve_records()
+            if counter.reserved == 0:
+                return False
+        counter.reserved -= 1
+        return True
+
+    def release_records(self):
+        # a thread that stops returns the records it reserved but did not emit
+        counter = self.get_counter()
+        n, counter.reserved = counter.reserved, 0
+        if n == 0:
+            return
+        budget_lock = self.lock if self.shared_count is None else self.shared_count.get_lock()
+        with budget_lock:
+            if self.shared_count is not None:
+                self.shared_count.value -= n
+                with self.lock:
+                    self.claimed -= n
+            else:
+                self.claimed -= n
+
+    def end_thread(self):
+        # a thread that stops returns its reserved records, and its counts are kept without its counter
+        self.release_records()
+        counter = self.get_counter()
+        with self.lock:
+            self.ended_records += counter.records
+            self.ended_bytes += counter.bytes
+            self.counters.remove(counter)
+        del self.local.counter
+
+    def inc_rec_count(self, size=0):
+        counter = self.get_counter()
+        counter.records += 1
+        counter.bytes += size
+
+    def budget_spent(self):
+        reserved = self.claimed if self.shared_count is None else self.shared_count.value
+        return reserved >= self.total_recs
 
     def is_done(self):
-        return ((self.total_recs is not None) and (self.record_count >= self.total_recs)) \
-                or ((self.t is not None) and ((self.get_duration() > self.t) or self.thread_end_event.is_set()))
+        # whether the calling thread should stop: it has emitted its reserved records and there are none left, or the time is up
+        if self.terminated:
+            return True
+        if self.total_recs is not None and self.get_counter().reserved == 0 and self.budget_spent():
+            return True
+        return self.end_time is not None and (self.thread_end_event.is_set() or self.global_clock.now() > self.end_time)
+
+    def is_complete(self):
+        # whether the whole job is done: every record reserved by this process has been emitted, or the time is up
+        if self.terminated:
+            return True
+        if self.total_recs is not None and self.budget_spent() and self.get_record_count() >= self.claimed:
+            return True
+        return self.end_time is not None and (self.thread_end_event.is_set() or self.global_clock.now() > self.end_time)
 
     def wait_for_end(self):
         if self.t is not None:
@@ -941,19 +2192,210 @@ class SimEnd:
         return self.global_clock.get_start_time()
 
     def get_record_count(self):
-        return self.record_count;
+        if self.shard_counts is not None:
+            return self.shard_counts.get_record_count()
+        with self.lock:
+            return self.ended_records + sum(counter.records for counter in self.counters)
+
+    def get_byte_count(self):
+        if self.shard_counts is not None:
+            return self.shard_counts.get_byte_count()
+        with self.lock:
+            return self.ended_bytes + sum(counter.bytes for counter in self.counters)
 
     def terminate(self):
-        if self.total_recs is not None:
-            self.record_count = self.total_recs
+        self.terminated = True
         self.thread_end_event.set()
 
 
+class RecordRates: # Samples the record count once per interval, so the rates over sliding windows cost nothing per record
+    windows = [10, 60, 300]
+    def __init__(self, sim_control, interval=1.0):
+        self.sim_control = sim_control
+        self.interval = interval
+        self.samples = collections.deque(maxlen=int(max(self.windows) / interval) + 1)
+        self.stopped = threading.Event()
+    def __str__(self):
+        return 'RecordRates(interval='+str(self.interval)+', windows='+str(self.windows)+')'
+    def start(self):
+        self.sample()
+        threading.Thread(target=self.run, name='RecordRates', daemon=True).start()
+    def stop(self):
+        self.stopped.set()
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+    def sample(self):
+        self.samples.append((time.monotonic(), self.sim_control.get_record_count()))
+    def get_rates(self):
+        now = time.monotonic()
+        count = self.sim_control.get_record_count()
+        samples = list(self.samples)
+        rates = {}
+        for window in self.windows:
+            # the oldest sample in the window, which is the first sample while the job is younger than the window
+            t, n = next((sample for sample in samples if sample[0] >= now - window), samples[-1])
+            rates[str(window)+'s'] = round((count - n) / (now - t), 1) if now > t else 0.0
+        return rates
+
+
+#
+# Replay sources
+# The rows of the source file are streamed, so memory does not grow with the size
+# of the file. The time of each row is parsed once, into seconds from the first
+# row, and kept in a compact array so the following cycles don't parse it again.
+#
+
+# the divisor that turns each numeric time format into seconds
+time_format_divisors = {'millis': 1000.0, 'seconds': 1.0, 'epoch': 1.0, 'posix': 1.0, 'nanos': 1000000000.0}
+
+def parse_time_seconds(value, time_format):
+    if time_format in time_format_divisors.keys():
+        return float(value) / time_format_divisors[time_format]
+    else:
+        dt = datetime.strptime(value, time_format)
+        if dt.tzinfo is not None:
+            # formats with %z give aware datetimes, whose timestamp already accounts for the offset
+            return dt.timestamp()
+        return (dt - datetime(1970, 1, 1)).total_seconds()
+
+def open_source_file(file_name, buffer_size):
+    # compressed files are recognized by their extension
+    if file_name.endswith('.gz'):
+        return io.TextIOWrapper(io.BufferedReader(gzip.GzipFile(file_name, 'rb'), buffer_size=buffer_size), encoding='utf-8', newline='')
+    elif file_name.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            msg = 'Error: zstd source files require the zstandard module'
+            raise Exception(msg)
+        raw = open(file_name, 'rb')
+        return io.TextIOWrapper(io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), buffer_size=buffer_size), encoding='utf-8', newline='')
+    return open(file_name, 'r', newline='', buffering=buffer_size)
+
+class ReplayReader: # Base class for the replay sources, read_rows() streams the rows of the file as dicts
+    def __init__(self, file_name, time_field, time_format, buffer_size=1048576):
+        self.file_name = file_name
+        self.time_field = time_field
+        self.time_format = time_format
+        self.buffer_size = buffer_size
+        self.offsets = None
+        self.start = None # the time the offsets are counted from, the first row of the earliest file in the set
+    def __str__(self):
+        return type(self).__name__+'(file_name='+self.file_name+', time_field='+self.time_field+', time_format='+self.time_format+')'
+    def read_rows(self):
+        pass
+    def read_timed_rows(self):
+        # yields (time in seconds, row)
+        for row in self.read_rows():
+            yield parse_time_seconds(row[self.time_field], self.time_format), row
+    def get_first_time(self):
+        for t, row in self.read_timed_rows():
+            return t
+        return None
+    def __iter__(self):
+        # yields (seconds from the start, row) for each row of the file
+        if self.offsets is not None:
+            return zip(self.offsets, self.read_rows())
+        return self.parse_rows()
+    def parse_rows(self):
+        offsets = array.array('d')
+        start = self.start
+        for t, row in self.read_timed_rows():
+            if start is None:
+                start = t
+            offsets.append(t - start)
+            yield offsets[-1], row
+        # only a complete pass is kept, a cycle cut short parses the times again
+        self.offsets = offsets
+
+class ReplayReaderCSV(ReplayReader):
+    def read_rows(self):
+        with open_source_file(self.file_name, self.buffer_size) as csvfile:
+            for row in csv.DictReader(csvfile):
+                yield row
+
+class ReplayReaderJSON(ReplayReader): # Newline-delimited JSON
+    def read_rows(self):
+        with open_source_file(self.file_name, self.buffer_size) as jsonfile:
+            for line in jsonfile:
+                if not line.isspace():
+                    yield json.loads(line)
+
+class ReplayReaderParquet(ReplayReader): # Streams the file one record batch at a time
+    def __init__(self, file_name, time_field, time_format, batch_size=65536):
+        super().__init__(file_name, time_field, time_format)
+        self.pa = import_pyarrow()
+        self.batch_size = batch_size
+    def read_batches(self):
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(self.file_name)
+        try:
+            for batch in parquet_file.iter_batches(batch_size=self.batch_size):
+                yield batch
+        finally:
+            parquet_file.close()
+    def read_rows(self):
+        for batch in self.read_batches():
+            for row in batch.to_pylist():
+                yield row
+    def get_times(self, column):
+        # timestamp and numeric time columns are converted as whole arrays, only string columns are parsed row by row
+        pa = self.pa
+        if pa.types.is_timestamp(column.type):
+            divisor = {'s': 1.0, 'ms': 1000.0, 'us': 1000000.0, 'ns': 1000000000.0}[column.type.unit]
+            return (column.cast(pa.int64()).to_numpy(zero_copy_only=False) / divisor).tolist()
+        elif pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+            if self.time_format not in time_format_divisors.keys():
+                msg = 'Error: time_format "'+self.time_format+'" does not apply to the numeric column '+self.time_field
+                raise Exception(msg)
+            return (column.to_numpy(zero_copy_only=False).astype(float) / time_format_divisors[self.time_format]).tolist()
+        return [parse_time_seconds(value, self.time_format) for value in column.to_pylist()]
+    def read_timed_rows(self):
+        for batch in self.read_batches():
+            times = self.get_times(batch.column(self.time_field))
+            for t, row in zip(times, batch.to_pylist()):
+                yield t, row
+
+def get_source_files(source_file):
+    # source_file is a file name, a glob pattern or a list of them
+    patterns = source_file if isinstance(source_file, list) else [source_file]
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            msg = 'Error: replay source file '+str(pattern)+' not found'
+            raise Exception(msg)
+        files.extend(matches)
+    return files
+
+class ReplayStats: # The pacing of one replay thread, for reporting the rates
+    def __init__(self):
+        self.cycle = 1
+        self.gap_total = 0.0
+        self.gap_count = 0
+        # how late the records emitted behind schedule were
+        self.late_records = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+def get_replay_reader(source_format, file_name, time_field, time_format):
+    source_format = source_format.lower()
+    if source_format == 'csv':
+        return ReplayReaderCSV(file_name, time_field, time_format)
+    elif source_format in ['json', 'ndjson']:
+        return ReplayReaderJSON(file_name, time_field, time_format)
+    elif source_format == 'parquet':
+        return ReplayReaderParquet(file_name, time_field, time_format)
+    msg = 'Error: Unknown replay source_format "'+source_format+'"'
+    raise Exception(msg)
+
+
 #
 # Run the driver
 #
 class DataDriver:
-    def __init__(self, name, config, target, runtime, total_recs, time_type, start_time, max_entities):
+    def __init__(self, name, config, target, runtime, total_recs, time_type, start_time, max_entities, batch_size=None, workers=1, merge=False, seed=None):
         self.name = name
         self.config = config
         self.target = target
@@ -973,71 +2415,41 @@ class DataDriver:
         self.sim_control = SimEnd(total_recs, runtime, self.global_clock)
 
 
+        #
+        # Seed the random number generators
+        # With a seed, the same configuration produces the same records. Each worker process
+        # gets its own stream, spawned from the seed.
+        #
+
+        if seed is None and 'seed' in config.keys():
+            seed = config['seed']
+        self.seed = None if seed is None else int(seed)
+        self.streams = RandomStreams()
+        if self.seed is not None:
+            self.streams.seed(self.get_seed_sequence(0))
+
+
         #
         # Set up the output target
+        # With several worker processes that write independently, each worker sets up its own target
         #
 
-        if target['type'].lower() == 'stdout':
-            self.target_printer = PrintStdout()
-        elif target['type'].lower() == 'file':
-            path = target['path']
-            if path is None:
-                msg = 'Error: File target requires a path item'
-                raise Exception(msg)
-            self.target_printer = PrintFile(path)
-        elif target['type'].lower() == 'kafka':
-            if 'endpoint' in target.keys():
-                endpoint = target['endpoint']
-            else:
-                msg = 'Error: Kafka target requires an endpoint item'
-                raise Exception(msg)
-            if 'topic' in target.keys():
-                topic = target['topic']
-            else:
-                msg = 'Error: Kafka target requires a topic item'
-                raise Exception(msg)
-            if 'security_protocol' in target.keys():
-                security_protocol = target['security_protocol']
-            else:
-                security_protocol = 'PLAINTEXT'
-            if 'compression_type' in target.keys():
-                compression_type = target['compression_type']
-            else:
-                compression_type = None
-            if 'topic_key' in target.keys():
-                topic_key = target['topic_key']
-            else:
-                topic_key = []
-            self.target_printer = PrintKafka(endpoint, topic, security_protocol, compression_type, topic_key)
-        elif target['type'].lower() == 'confluent':
-            if 'servers' in target.keys():
-                servers = target['servers']
-            else:
-                msg = 'Error: Conlfuent target requires a servers item'
-                raise Exception(msg)
-            if 'topic' in target.keys():
-                topic = target['topic']
-            else:
-                msg = 'Error: Confluent target requires a topic item'
-                raise Exception(msg)
-            if 'username' in target.keys():
-                username = target['username']
-            else:
-                msg = 'Error: Confluent target requires a username'
-                raise Exception(msg)
-            if 'password' in target.keys():
-                password = target['password']
-            else:
-                msg = 'Error: Confluent target requires a password'
-                raise Exception(msg)
-            if 'topic_key' in target.keys():
-                topic_key = target['topic_key']
-            else:
-                topic_key = []
-            self.target_printer = PrintConfluent(servers, topic, username, password, topic_key)
+        self.workers = int(workers)
+        self.merge = merge
+        if self.workers > 1 and target['type'].lower() == 'stdout':
+            # the processes would share one stdout, and blocks larger than a pipe buffer are not written atomically
+            self.merge = True
+        self.first_spawn_delay = 0.0
+        self.scheduler = None
+        self.rates = None
+        self.queues = []
+        # the values of the key fields are passed to the target along with each record
+        if 'topic_key' in target.keys():
+            self.key_fields = list(target['topic_key'])
         else:
-            msg = 'Error: Unknown target type "'+target['type']+'"'
-            raise Exception(msg)
+            self.key_fields = []
+        # columnar targets take the values of all the fields instead of a JSON record
+        self.columnar = target['type'].lower() in ['parquet', 'arrow', 'orc']
 
 
         # A different source of data generation is a digital twin mode
@@ -1054,14 +2466,20 @@ class DataDriver:
 
         if self.type=='replay':        
             if 'source_file' in config.keys():
-                self.replay_file = config['source_file']
+                self.replay_files = get_source_files(config['source_file'])
             else:
                 msg='Error: "type" = `replay` requires a "source_file".'
                 raise Exception(msg)
+            if self.workers > len(self.replay_files):
+                msg = 'Error: "type" = `replay` cannot have more worker processes than source files.'
+                raise Exception(msg)
+            if self.merge and self.workers == 1:
+                # merging needs the files to be replayed by worker processes that feed the single writer
+                self.workers = min(len(self.replay_files), max(2, os.cpu_count()))
             if 'source_format' in config.keys():
                 self.source_format = config['source_format']
             else:
-                self.source_format = 'csv' # default to csv as it is the only supported format for now
+                self.source_format = 'csv'
 
             if 'time_field' in config.keys():
                 self.time_field = config['time_field']
@@ -1096,23 +2514,79 @@ class DataDriver:
                     raise Exception(msg)
             else:
                 self.do_time_skips = False
+            # the gaps between events are divided by the speed factor, a target rate sets the factor from the mean gap
+            self.speed_factor = 1.0
+            self.target_rate = None
+            if 'speed_factor' in config.keys() and 'target_rate' in config.keys():
+                msg = 'Error: "speed_factor" and "target_rate" cannot both be used in a replay config'
+                raise Exception(msg)
+            if 'speed_factor' in config.keys():
+                self.speed_factor = float(config['speed_factor'])
+                if self.speed_factor <= 0:
+                    msg = 'Error: "speed_factor" must be greater than 0'
+                    raise Exception(msg)
+            if 'target_rate' in config.keys():
+                self.target_rate = float(config['target_rate'])
+                if self.target_rate <= 0:
+                    msg = 'Error: "target_rate" must be greater than 0'
+                    raise Exception(msg)
+            self.replay_stats = []
+            self.replay_errors = []
+            self.replay_readers = [get_replay_reader(self.source_format, f, self.time_field, self.time_format) for f in self.replay_files]
+            if len(self.replay_readers) > 1:
+                # the files are replayed from the earliest first row of the set, so they keep their timing relative to each other
+                first_times = [t for t in [reader.get_first_time() for reader in self.replay_readers] if t is not None]
+                for reader in self.replay_readers:
+                    reader.start = min(first_times) if len(first_times) > 0 else None
 
         elif self.type=='generator':
             #
             # Set up the interarrival rate
             #
             self.type='generator'
+            # single samples of the distributions are drawn sample_block_size at a time
+            if 'sample_block_size' in config.keys():
+                self.streams.set_block_size(int(config['sample_block_size']))
+            # in real time the workers are paced by a scheduler that wakes once per tick, or each runs in its own thread
+            self.pacing = 'tick'
+            if 'pacing' in config.keys():
+                self.pacing = config['pacing']
+                if self.pacing not in ['tick', 'threads']:
+                    msg = 'Error: "pacing" must be "tick" or "threads".'
+                    raise Exception(msg)
+            self.pacing_tick = 0.005
+            if 'pacing_tick' in config.keys():
+                self.pacing_tick = float(config['pacing_tick'])
+                if self.pacing_tick <= 0:
+                    msg = 'Error: "pacing_tick" must be greater than 0.'
+                    raise Exception(msg)
             rate = self.config['interarrival']
-            self.rate_delay = parse_distribution(rate)
+            self.rate_delay = parse_distribution(rate, self.streams)
 
             #
             # Set up emitters list
             #
+            # batch_size > 1 switches to batch generation of the emitter fields
+            if batch_size is None:
+                if 'batch_size' in config.keys():
+                    batch_size = config['batch_size']
+                else:
+                    batch_size = 1
+            self.batch_size = int(batch_size)
+            if self.batch_size < 1:
+                msg = 'Error: "batch_size" must be a positive integer.'
+                raise Exception(msg)
+
             self.emitters = {}
+            self.batches = {}
+            self.templates = {}
             for emitter in self.config['emitters']:
                 name = emitter['name']
-                dimensions = get_dimensions(emitter['dimensions'], self.global_clock)
+                dimensions = get_dimensions(emitter['dimensions'], self.global_clock, self.streams)
                 self.emitters[name] = dimensions
+                self.templates[name] = RecordTemplate(dimensions, self.streams, self.key_fields)
+                if self.batch_size > 1:
+                    self.batches[name] = RecordBatch(dimensions, self.batch_size, self.key_fields)
 
             #
             # Set up the state machine
@@ -1126,11 +2600,13 @@ class DataDriver:
                 if 'variables' not in state.keys():
                     variables = []
                 else:
-                    variables = get_variables(state['variables'])
+                    variables = get_variables(state['variables'], self.streams)
                 dimensions = self.emitters[emitter_name]
-                delay = parse_distribution(state['delay'])
+                template = self.templates[emitter_name]
+                batch = self.batches.get(emitter_name)
+                delay = parse_distribution(state['delay'], self.streams)
                 transitions = parse_transitions(state['transitions'])
-                this_state = State(name, dimensions, delay, transitions, variables)
+                this_state = State(name, dimensions, delay, transitions, variables, template, self.streams, batch)
                 self.states[name] = this_state
                 if self.initial_state == None:
                     self.initial_state = this_state
@@ -1138,18 +2614,138 @@ class DataDriver:
             msg = f"Error: Unknown `type` = {self.type}."
             raise Exception(msg)
 
+        if self.workers > 1 and not self.merge:
+            self.target_printer = None
+        else:
+            self.target_printer = self.create_target_printer(target)
+
 
 
-    def create_record(self, dimensions, variables):
-            json_string = '{'
+    def create_target_printer(self, target):
+        if target['type'].lower() == 'stdout':
+            buffer_size = int(target['buffer_size']) if 'buffer_size' in target.keys() else 65536
+            flush_interval = float(target['flush_interval']) if 'flush_interval' in target.keys() else 1.0
+            target_printer = PrintStdout(buffer_size, flush_interval)
+        elif target['type'].lower() == 'null':
+            count_bytes = bool(target['count_bytes']) if 'count_bytes' in target.keys() else False
+            hash_name = target['hash'].lower() if 'hash' in target.keys() else None
+            target_printer = PrintNull(count_bytes, hash_name)
+        elif target['type'].lower() == 'file':
+            path = target['path']
+            if path is None:
+                msg = 'Error: File target requires a path item'
+                raise Exception(msg)
+            buffer_size = int(target['buffer_size']) if 'buffer_size' in target.keys() else 65536
+            flush_interval = float(target['flush_interval']) if 'flush_interval' in target.keys() else 1.0
+            compression = target['compression'].lower() if 'compression' in target.keys() else None
+            rotate_bytes = int(target['rotate_bytes']) if 'rotate_bytes' in target.keys() else None
+            rotate_records = int(target['rotate_records']) if 'rotate_records' in target.keys() else None
+            rotate_interval = parse_duration(target['rotate_interval']) if 'rotate_interval' in target.keys() else None
+            target_printer = PrintFile(path, buffer_size, flush_interval, compression, rotate_bytes, rotate_records, rotate_interval, self.global_clock)
+        elif target['type'].lower() == 'kafka':
+            if 'endpoint' in target.keys():
+                endpoint = target['endpoint']
+            else:
+                msg = 'Error: Kafka target requires an endpoint item'
+                raise Exception(msg)
+            if 'topic' in target.keys():
+                topic = target['topic']
+            else:
+                msg = 'Error: Kafka target requires a topic item'
+                raise Exception(msg)
+            if 'security_protocol' in target.keys():
+                security_protocol = target['security_protocol']
+            else:
+                security_protocol = 'PLAINTEXT'
+            if 'compression_type' in target.keys():
+                compression_type = target['compression_type']
+            else:
+                compression_type = None
+            record_key = parse_record_key(target)
+            if 'delivery' in target.keys():
+                delivery = target['delivery'].lower()
+                if delivery not in ['sync', 'async']:
+                    msg = 'Error: Kafka target "delivery" must be "sync" or "async"'
+                    raise Exception(msg)
+            else:
+                delivery = 'sync'
+            # producer batching options are passed straight through to the KafkaProducer
+            producer_config = {}
+            for option in ['linger_ms', 'batch_size', 'max_in_flight_requests_per_connection']:
+                if option in target.keys():
+                    producer_config[option] = int(target[option])
+            target_printer = PrintKafka(endpoint, topic, security_protocol, compression_type, record_key, delivery, producer_config)
+        elif target['type'].lower() == 'confluent':
+            if 'servers' in target.keys():
+                servers = target['servers']
+            else:
+                msg = 'Error: Conlfuent target requires a servers item'
+                raise Exception(msg)
+            if 'topic' in target.keys():
+                topic = target['topic']
+            else:
+                msg = 'Error: Confluent target requires a topic item'
+                raise Exception(msg)
+            if 'username' in target.keys():
+                username = target['username']
+            else:
+                msg = 'Error: Confluent target requires a username'
+                raise Exception(msg)
+            if 'password' in target.keys():
+                password = target['password']
+            else:
+                msg = 'Error: Confluent target requires a password'
+                raise Exception(msg)
+            record_key = parse_record_key(target)
+            target_printer = PrintConfluent(servers, topic, username, password, record_key)
+        elif self.columnar:
+            if 'path' not in target.keys():
+                msg = 'Error: '+target['type']+' target requires a path item'
+                raise Exception(msg)
+            row_group_size = int(target['row_group_size']) if 'row_group_size' in target.keys() else 100000
+            compression = target['compression'].lower() if 'compression' in target.keys() else None
+            target_printer = PrintColumnar(target['path'], target['type'].lower(), self.get_schema_elements(), row_group_size, compression)
+        else:
+            msg = 'Error: Unknown target type "'+target['type']+'"'
+            raise Exception(msg)
+        return target_printer
+
+    def get_schema_elements(self):
+        # the columns are the fields of all the emitters, in order of appearance
+        if self.type != 'generator':
+            return None
+        elements = {}
+        for dimensions in self.emitters.values():
             for element in dimensions:
-                if isinstance(element, ElementVariable):
-                    json_string += element.get_json_field_string(variables) + ','
-                else:
-                    if isinstance(element, ElementNow) or not element.is_missing():
-                        json_string += element.get_json_field_string() + ','
-            json_string = json_string[:-1] + '}'
-            return json_string
+                if element.name not in elements.keys():
+                    elements[element.name] = element
+                elif get_column_kind(elements[element.name]) != get_column_kind(element):
+                    msg = 'Error: Field "'+element.name+'" has different types in different emitters'
+                    raise Exception(msg)
+        return list(elements.values())
+
+    def get_key_values(self):
+        if len(self.key_fields) == 0:
+            return None
+        return dict.fromkeys(self.key_fields)
+
+    def create_values(self, dimensions, variables):
+        values = {}
+        for element in dimensions:
+            if isinstance(element, ElementVariable):
+                values[element.name] = element.get_value(variables)
+            elif isinstance(element, ElementNow) or not element.is_missing():
+                values[element.name] = element.get_value()
+        return values
+
+    def generate(self, state, variables):
+        # returns the JSON record and the values of the fields the target needs
+        if self.columnar:
+            return None, self.create_values(state.dimensions, variables)
+        values = self.get_key_values()
+        if state.batch is not None:
+            return state.batch.create_record(variables, values), values
+        return state.template.create_record(variables, values), values
 
     def set_variable_values(self, variables, dimensions):
         for d in dimensions:
@@ -1163,15 +2759,13 @@ class DataDriver:
         variables = {}
         while True:
             self.set_variable_values(variables, current_state.variables)
-            record = self.create_record(current_state.dimensions, variables)
-            self.target_printer.print(record)
-            self.sim_control.inc_rec_count()
-            if self.sim_control.is_done():
+            record, values = self.generate(current_state, variables)
+            if not self.sim_control.claim_record():
                 break
+            self.target_printer.print(record, values)
+            self.sim_control.inc_rec_count(0 if record is None else len(record))
             delta = float(current_state.delay.get_sample())
-            #self.status_msg=f"Thread sleeping {delta} seconds. Sim Clock: {self.global_clock.now()}"
             self.global_clock.sleep(delta)
-            self.status_msg=f"Running, Sim Clock: {self.global_clock.now()}"
             if self.sim_control.is_done():
                 break
             next_state_name = current_state.get_next_state_name()
@@ -1180,19 +2774,24 @@ class DataDriver:
             current_state = self.states[next_state_name]
 
         #print('Thread '+threading.current_thread().name+' done!')
+        self.sim_control.end_thread()
         self.global_clock.end_thread()
         self.sim_control.remove_entity()
 
     def spawning_thread(self):
+        self.status_msg = 'Running.'
         self.global_clock.activate_thread()
+        self.global_clock.sleep(self.first_spawn_delay)
 
         # Spawn the workers in a separate thread so we can stop the whole thing in the middle of spawning if necessary
-        while not self.sim_control.is_done():
+        # the workers may still hold records reserved from the budget, so the spawner waits until they are all emitted
+        while not self.sim_control.is_complete():
             if (self.sim_control.get_entity_count() < self.max_entities):
                 thread_name = 'W'+str(self.sim_control.get_entity_count())
                 self.sim_control.add_entity()
                 t = threading.Thread(target=self.worker_thread, name=thread_name, daemon=True)
                 t.start()
+                self.worker_threads = [w for w in self.worker_threads if w.is_alive()] + [t]
                 # add a sleep event before spawning the next
                 self.global_clock.sleep(float(self.rate_delay.get_sample()))
             else:
@@ -1201,102 +2800,351 @@ class DataDriver:
         # shut off clock simulator
         self.global_clock.end_thread()
 
-    def parse_time_from_record(self, json_obj, time_field, time_format) -> datetime:
-        if time_format == 'millis':
-            return datetime.fromtimestamp(float(json_obj[time_field])/1000.0)
-        elif time_format == 'seconds' or time_format == 'epoch' or time_format == 'posix':
-            return datetime.fromtimestamp(float(json_obj[time_field]))
-        elif time_format == 'nanos':
-            return datetime.fromtimestamp(float(json_obj[time_field])/1000000.0)
+    def run_entity(self, scheduler, entity):
+        # Emit the record for the entity's current state, then schedule its next transition
+        state = entity.state
+        self.set_variable_values(entity.variables, state.variables)
+        record, values = self.generate(state, entity.variables)
+        if not self.sim_control.claim_record():
+            return
+        self.target_printer.print(record, values)
+        self.sim_control.inc_rec_count(0 if record is None else len(record))
+        scheduler.schedule(float(state.delay.get_sample()), entity)
+
+    def event_loop(self):
+        # Process the state machines of all the entities in a single thread using simulated time
+        if self.time_type == 'REAL':
+            scheduler = TickScheduler(self.global_clock, self.pacing_tick)
         else:
-            return datetime.strptime(json_obj[time_field], time_format)
+            scheduler = EventScheduler(self.global_clock)
+        self.scheduler = scheduler
+        self.status_msg = 'Running.'
+        spawner = Entity('Spawning', None)
+        scheduler.schedule(self.first_spawn_delay, spawner)
+        while True:
+            # checked once the clock has moved to the next event
+            entity = scheduler.next_entity()
+            if entity is None or self.sim_control.is_done():
+                break
+            if entity is spawner:
+                if self.sim_control.get_entity_count() < self.max_entities:
+                    worker = Entity('W'+str(self.sim_control.get_entity_count()), self.initial_state)
+                    self.sim_control.add_entity()
+                    self.run_entity(scheduler, worker)
+                    scheduler.schedule(float(self.rate_delay.get_sample()), spawner)
+                else:
+                    scheduler.schedule(5.0, spawner)
+            else:
+                next_state_name = entity.state.get_next_state_name()
+                if next_state_name.lower() == 'stop':
+                    self.sim_control.remove_entity()
+                    continue
+                entity.state = self.states[next_state_name]
+                self.run_entity(scheduler, entity)
 
     def get_new_time_for_record(self):
             return self.global_clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')
 
-    def replay_thread(self):
+    def replay_thread(self, reader, stats):
         # process replay file, generate events based on global clock
-        # read the source file
-        import json
-        import csv
-        import copy
-        import random
-
-        self.global_clock.activate_thread()
-
-        data = []
-        self.status_msg = f"Reading data from file {self.replay_file}..."
-        with open(self.replay_file, 'r') as csvfile:
-            for line in csv.DictReader(csvfile):
-                data.append(line)
-        total_source_recs = len(data)
-        cycle = 0
-        self.status_msg = f"Read {total_source_recs} rows from file... sim control is done = {self.sim_control.is_done()}"
-        sim_start_time = self.global_clock.now()
-        while not self.sim_control.is_done():
-            cycle += 1
-            self.status_msg =  f"Generating data, cycle:{cycle} with max of {total_source_recs} messages per cycle."
-            i = 0 # start each cycle through from the beginning of the replay event sequence
-            while i < total_source_recs:
-                current_source_time = self.parse_time_from_record( data[i], self.time_field, self.time_format)
-                json_obj = copy.deepcopy(data[i])
-                # reset time on the output object to simulated time
+        # the thread was activated on the clock before it started, so no thread runs ahead of the others in simulated time
+        try:
+            rows = iter(reader)
+            cycle = 1
+            i = 0
+            due = None
+            # with several source files the target rate is shared evenly between them
+            target_rate = None if self.target_rate is None else self.target_rate / len(self.replay_files)
+            current = next(rows, None)
+            if current is None:
+                msg = 'Error: replay source file '+reader.file_name+' has no rows'
+                raise Exception(msg)
+            if current[0] > 0 and target_rate is None:
+                # a file that starts after the earliest one in the set waits for its first row
+                gap = current[0] / self.speed_factor
+                if self.global_clock.time_type == 'REAL':
+                    due = time.monotonic() + gap
+                self.global_clock.sleep(gap)
+            while not self.sim_control.is_done():
+                current_offset, json_obj = current
+                # reset time on the output object to simulated time, the row is not used again so it can be changed in place
                 json_obj[self.time_field]=self.get_new_time_for_record()
-                self.status_msg =  f"Replaying: Cycle:{cycle} msg:{i} - Sim clock:{json_obj[self.time_field]}."
                 #do null injections if configured
                 if self.do_null_injection:
                     for nuller in self.null_injections:
-                        if random.random()<nuller['null_probability']:
+                        if self.streams.random.random()<nuller['null_probability']:
                             json_obj[nuller['field']] = None
                 # print record to defined target
-                record = json.dumps(json_obj)
-                self.target_printer.print(record)
-                self.sim_control.inc_rec_count()
-                i += 1 # move to next event in the replay set
-                if i < total_source_recs:
-                    next_source_time = self.parse_time_from_record( data[i], self.time_field, self.time_format)
-                    if self.do_time_skips and random.random()<self.time_skip_config['skip_probability']:
-                        # calculate skip time in seconds
-                        skip_time = random.uniform(self.time_skip_config['min_skip_duration'], self.time_skip_config['max_skip_duration'])
-                        self.status_msg =  f"Replaying: Cycle:{cycle} msg:{i} - Sim clock:{json_obj[self.time_field]}. Skipping {skip_time} seconds."
-                        # find the next event in the sequence that is after the skip time
-                        while ((next_source_time - current_source_time).total_seconds() < skip_time) and (i < total_source_recs-1):
-                            i += 1
-                            next_source_time = self.parse_time_from_record( data[i], self.time_field, self.time_format)
-                            self.status_msg =  f"Replaying: Cycle:{cycle} msg:{i} - Sim clock:{json_obj[self.time_field]}. Skipping {skip_time} seconds."
-                    # advance time according to the elapsed time between events in the replay file
-                    self.global_clock.sleep(float((next_source_time - current_source_time).total_seconds()))
-                if self.sim_control.is_done():
+                # Parquet sources can hold values without a JSON type, such as timestamps, which are written as strings
+                record = None if self.columnar else json.dumps(json_obj, default=str)
+                if not self.sim_control.claim_record():
                     break
-        self.global_clock.end_thread()
+                self.target_printer.print(record, json_obj)
+                self.sim_control.inc_rec_count(0 if record is None else len(record))
+                i += 1 # move to next event in the replay set
+                current = next(rows, None)
+                if current is not None and self.do_time_skips and self.streams.random.random()<self.time_skip_config['skip_probability']:
+                    # calculate skip time in seconds
+                    skip_time = self.streams.random.uniform(self.time_skip_config['min_skip_duration'], self.time_skip_config['max_skip_duration'])
+                    # find the next event in the sequence that is after the skip time
+                    while current is not None and current[0] - current_offset < skip_time:
+                        i += 1
+                        current = next(rows, None)
+                if current is None:
+                    # start each cycle through from the beginning of the replay event sequence
+                    cycle += 1
+                    stats.cycle = cycle
+                    i = 0
+                    rows = iter(reader)
+                    current = next(rows)
+                    continue
+                # advance time according to the elapsed time between events in the replay file, scaled by the speed factor
+                gap = current[0] - current_offset
+                stats.gap_total += gap
+                stats.gap_count += 1
+                if target_rate is None:
+                    gap = gap / self.speed_factor
+                elif stats.gap_total > 0:
+                    # the mean gap is estimated from the events replayed so far
+                    gap = gap * stats.gap_count / (target_rate * stats.gap_total)
+                else:
+                    gap = 1.0 / target_rate
+                if self.global_clock.time_type != 'REAL':
+                    self.global_clock.sleep(gap)
+                    continue
+                # in real time each event has a due time, events that are already due are emitted in a burst without sleeping
+                if due is None:
+                    due = time.monotonic()
+                due += gap
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.global_clock.sleep(delay)
+                else:
+                    stats.late_records += 1
+                    stats.lag_total -= delay
+                    if -delay > stats.lag_max:
+                        stats.lag_max = -delay
+        except Exception as e:
+            # stop the other threads instead of leaving them waiting on this one, simulate() raises the error once they have stopped
+            self.replay_errors.append(e)
+            self.sim_control.terminate()
+            self.global_clock.wake_all()
+        finally:
+            self.sim_control.end_thread()
+            self.global_clock.end_thread()
+
+    def get_replay_rates(self):
+        # the target rate in events per second of the clock, and the rate achieved so far
+        elapsed = (self.global_clock.now() - self.global_clock.get_start_time()).total_seconds()
+        achieved = round(self.sim_control.get_record_count() / elapsed, 1) if elapsed > 0 else None
+        if self.target_rate is not None:
+            target = self.target_rate * len(self.replay_readers) / len(self.replay_files)
+        elif len(self.replay_stats) > 0 and all(stats.gap_total > 0 for stats in self.replay_stats):
+            # the stats are kept by the threads of this process, the parent of worker processes has none
+            target = round(sum(self.speed_factor * stats.gap_count / stats.gap_total for stats in self.replay_stats), 1)
+        else:
+            target = None
+        return target, achieved
+
+    def get_seed_sequence(self, index):
+        # stream 0 is used to set up the job, stream i+1 by worker process i
+        return np.random.SeedSequence(self.seed).spawn(index + 1)[index]
+
+    def run_shard(self, index, shared_count, queue, shard_counts):
+        # Runs in a forked worker process. The element cardinality tables were built before the fork so they are shared by all the workers.
+        # without a seed the processes still need streams of their own, the forked ones are copies of the parent's
+        self.streams.seed(None if self.seed is None else self.get_seed_sequence(index + 1))
+        if self.type == 'replay':
+            # each process replays its share of the source files
+            self.replay_readers = self.replay_readers[index::self.workers]
+        else:
+            self.max_entities = self.max_entities // self.workers + (1 if index < self.max_entities % self.workers else 0)
+            self.first_spawn_delay = index * float(self.rate_delay.get_sample())
+            self.rate_delay = DistScaled(self.rate_delay, self.workers)
+            for dimensions in self.emitters.values():
+                shard_counters(dimensions, index, self.workers)
+            for state in self.states.values():
+                shard_counters(state.variables, index, self.workers)
+        if queue is not None:
+            # the writer process enforces the record limit on the merged records
+            self.sim_control = SimEnd(None, self.runtime, self.global_clock)
+            self.target_printer = PrintQueue(queue, self.global_clock)
+        elif self.seed is not None and self.total_recs is not None:
+            # with a seed each process writes a fixed share of the records, so its file doesn't depend on the speed of the others
+            total_recs = self.total_recs // self.workers + (1 if index < self.total_recs % self.workers else 0)
+            self.sim_control = SimEnd(total_recs, self.runtime, self.global_clock)
+        else:
+            # the processes share the budget, so each claims one record at a time and none of them runs on with a block of it
+            self.sim_control = SimEnd(self.total_recs, self.runtime, self.global_clock, shared_count, block_size=1)
+        if queue is None:
+            target = dict(self.target)
+            if target['type'].lower() in ['file', 'parquet', 'arrow', 'orc']:
+                root, ext = os.path.splitext(target['path'])
+                target['path'] = root+'-'+str(index)+ext
+            self.target_printer = self.create_target_printer(target)
+        self.workers = 1
+        if shard_counts is None:
+            self.simulate()
+            return
+        # the parent process reports the counts of the processes that write on their own
+        stop = threading.Event()
+        thrd = threading.Thread(target=shard_counts.publish_thread, args=(index, self.sim_control, stop), name='ShardCounts', daemon=True)
+        thrd.start()
+        self.simulate()
+        stop.set()
+        shard_counts.publish(index, self.sim_control)
+
+    def merge_shards(self, queues):
+        # The single writer: merge the records of all the worker processes in time order
+        def shard_records(queue):
+            while True:
+                block = queue.get()
+                if block is None:
+                    return
+                yield from block
+        for t, record, values in heapq.merge(*[shard_records(q) for q in queues], key=lambda r: r[0]):
+            if not self.sim_control.claim_record():
+                break
+            # the writer's clock follows the records, so the target rotates and the report shows the time of the last record
+            self.global_clock.advance(t)
+            self.target_printer.print(record, values)
+            self.sim_control.inc_rec_count(0 if record is None else len(record))
+            if self.sim_control.is_done():
+                break
+
+    def simulate_workers(self):
+        # the cardinality tables must be identical in all the workers, so the workers are forked from this process
+        context = multiprocessing.get_context('fork')
+        shared_count = context.Value('q', 0)
+        queues = [context.Queue(maxsize=100) if self.merge else None for i in range(self.workers)]
+        shard_counts = None
+        if self.merge:
+            self.queues = queues
+        else:
+            shard_counts = ShardCounts(context, self.workers)
+            self.sim_control.shard_counts = shard_counts
+        processes = []
+        for i in range(self.workers):
+            p = context.Process(target=self.run_shard, args=(i, shared_count, queues[i], shard_counts), name='Worker'+str(i), daemon=True)
+            p.start()
+            processes.append(p)
+        self.status_msg = f'Running {self.workers} worker processes.'
+        if self.merge:
+            self.merge_shards(queues)
+            # the workers may still be generating records the writer no longer needs
+            for p in processes:
+                p.terminate()
+        for p in processes:
+            p.join()
+        if shard_counts is not None:
+            # the job is complete once all the processes have stopped
+            self.sim_control.terminate()
 
     def simulate(self):
         self.status_msg=f'Starting {self.type} job.'
-        if self.type == 'replay':
-            # run a single replay thread, no data generation needed except for new timestamps
-            thread_name = 'DigitalTwinSimulator'
-            self.sim_control.add_entity()
-            thrd = threading.Thread(target=self.replay_thread, name=thread_name, daemon=True)
-            thrd.start()
+        self.rates = RecordRates(self.sim_control)
+        self.rates.start()
+        if self.workers > 1:
+            self.simulate_workers()
+        elif self.type == 'replay':
+            # run a replay thread for each source file, no data generation needed except for new timestamps
+            self.status_msg = f'Replaying {len(self.replay_readers)} source files.'
+            threads = []
+            if len(self.replay_readers) > 1:
+                # the replay threads each keep their own pace, a block reserved by one would hold back the records of the others
+                self.sim_control.block_size = 1
+            for i, reader in enumerate(self.replay_readers):
+                stats = ReplayStats()
+                self.replay_stats.append(stats)
+                self.sim_control.add_entity()
+                self.global_clock.activate_thread()
+                threads.append(threading.Thread(target=self.replay_thread, args=(reader, stats), name='DigitalTwinSimulator'+str(i), daemon=True))
+            for thrd in threads:
+                thrd.start()
+            for thrd in threads:
+                thrd.join()
+            if len(self.replay_errors) > 0:
+                self.status_msg = str(self.replay_errors[0])
+                if self.target_printer is not None:
+                    self.target_printer.close()
+                self.rates.stop()
+                raise self.replay_errors[0]
+            target, achieved = self.get_replay_rates()
+            late_records = sum(stats.late_records for stats in self.replay_stats)
+            self.status_msg = f"Replayed {self.sim_control.get_record_count()} records at {achieved} records/s, target {target} records/s, {late_records} late."
+            if self.target_rate is not None or self.speed_factor != 1.0:
+                # records may be going to stdout, so the rates go to stderr
+                print('Info: '+self.status_msg, file=sys.stderr)
+        elif self.time_type != 'REAL' or self.pacing == 'tick':
+            # simulated time does not need a thread per entity, run the discrete-event scheduler instead
+            # in real time the same scheduler sleeps until the next tick and then runs all the events that are due
+            self.event_loop()
         else:
+            # the worker threads each keep their own pace, a block reserved by one would hold back the records of the others
+            self.sim_control.block_size = 1
+            self.worker_threads = []
             thrd = threading.Thread(target=self.spawning_thread, args=(), name='Spawning', daemon=True)
             thrd.start()
-        thrd.join()
+            thrd.join()
+            # wake up the sleeping workers so they see the job is done before the target is closed
+            self.global_clock.wake_all()
+            for t in self.worker_threads:
+                t.join()
+        if self.target_printer is not None:
+            self.target_printer.close()
+        self.rates.stop()
 
     def terminate(self):
         self.sim_control.terminate()
+        self.global_clock.wake_all()
+        if self.target_printer is not None:
+            self.target_printer.flush()
 
     def report(self):
-        return {  'name': self.name,
+        result = {  'name': self.name,
                   'config_file': self.config['config_file'],
                   'target': self.target,
                   'active_sessions': self.sim_control.get_entity_count(),
                   'total_records': self.sim_control.get_record_count(),
                   'start_time': self.sim_control.get_start_time().strftime('%Y-%m-%d %H:%M:%S'),
                   'run_time': self.sim_control.get_duration(),
-                  'status' : 'COMPLETE' if self.sim_control.is_done() else 'RUNNING',
-                  'status_msg' : self.status_msg
+                  'status' : 'COMPLETE' if self.sim_control.is_complete() else 'RUNNING',
+                  'status_msg' : self.status_msg,
+                  'sim_clock': self.global_clock.now().strftime('%Y-%m-%d %H:%M:%S'),
+                  'metrics': self.get_metrics()
                 }
+        if hasattr(self.target_printer, 'delivery_failures'):
+            result['delivery_failures'] = self.target_printer.delivery_failures
+        if isinstance(self.target_printer, PrintNull):
+            result['null_target'] = self.target_printer.get_summary()
+        if self.type == 'replay':
+            result['target_rate'], result['achieved_rate'] = self.get_replay_rates()
+            result['late_records'] = sum(stats.late_records for stats in self.replay_stats)
+        return result
+
+    def get_metrics(self):
+        # everything here is read from counters kept by the job, nothing is measured per record to report it
+        metrics = {'records_per_second': None if self.rates is None else self.rates.get_rates(),
+                   'bytes': self.sim_control.get_byte_count()}
+        if hasattr(self.target_printer, 'latency'):
+            metrics['send_latency'] = self.target_printer.latency.get_summary()
+        if isinstance(self.scheduler, TickScheduler):
+            metrics['pacing_error'] = self.scheduler.get_pacing_error()
+        elif self.type == 'replay' and len(self.replay_stats) > 0:
+            late_records = sum(stats.late_records for stats in self.replay_stats)
+            lag_total = sum(stats.lag_total for stats in self.replay_stats)
+            metrics['pacing_error'] = {'late_records': late_records,
+                                       'mean_lag': round(lag_total / late_records, 6) if late_records > 0 else 0.0,
+                                       'max_lag': round(max(stats.lag_max for stats in self.replay_stats), 6)}
+        queue_depth = {}
+        if self.scheduler is not None:
+            queue_depth['events'] = len(self.scheduler)
+        if hasattr(self.target_printer, 'get_queue_depth'):
+            queue_depth['target'] = self.target_printer.get_queue_depth()
+        if len(self.queues) > 0:
+            queue_depth['workers'] = sum(queue.qsize() for queue in self.queues)
+        metrics['queue_depth'] = queue_depth
+        return metrics
 
 
 def main():
@@ -1311,6 +3159,11 @@ def main():
     parser.add_argument('-n', dest='n_recs', nargs='?', help='the number of records to generate (may not be used with -t)')
     parser.add_argument('-s', dest='time_type', nargs='?', const='SIM', default='REAL', help='simulate time (default is real, not simulated)')
     parser.add_argument('-m', dest='concurrency', nargs='?', default=100, help='max entities concurrently generating events')
+    parser.add_argument('-b', dest='batch_size', nargs='?', help='generate emitter fields in batches of this many records')
+    parser.add_argument('-w', '--workers', dest='workers', nargs='?', default=1, help='the number of worker processes to shard the entities across')
+    parser.add_argument('--merge', dest='merge', action='store_true', help='merge the output of the worker processes into the target in time order')
+    parser.add_argument('--seed', dest='seed', nargs='?', help='seed the random number generators to make the output reproducible')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true', help='generate the records but discard them, in place of the target')
 
     args = parser.parse_args()
 
@@ -1342,13 +3195,26 @@ def main():
     else:
         config = json.load(sys.stdin)
 
-    if target_file_name:
+    if args.dry_run:
+        # the null target counts the bytes, so the run reports what it would have written
+        target = {'type': 'null', 'count_bytes': True}
+    elif target_file_name:
         with open(target_file_name, 'r') as f:
             target = json.load(f)
     elif 'target' in config.keys():
         target = config['target']
 
-    driver = DataDriver('cli', config, target, runtime, total_recs, time_type, start_time, max_entities)
+    batch_size = None
+    if args.batch_size is not None:
+        batch_size = int(args.batch_size)
+
+    workers = int(args.workers)
+
+    seed = None
+    if args.seed is not None:
+        seed = int(args.seed)
+
+    driver = DataDriver('cli', config, target, runtime, total_recs, time_type, start_time, max_entities, batch_size, workers, args.merge, seed)
     driver.simulate()
 
 
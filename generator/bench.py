@@ -0,0 +1,206 @@
+#
+# Benchmarks the data driver. Each shipped config under config_file/ is run with a
+# simulated clock against a null, a file and a mock Kafka target, and the results
+# are saved as JSON so that runs before and after a change can be compared.
+#
+# Run the benchmarks from the root of the repository as follows:
+# python generator/bench.py <options> [config file names]
+# Options include:
+# -n <number of records to generate in each run>
+# -o <results file name>
+# --compare <results file of an earlier run>
+# --replay-source <file replayed by the replay configs, whose own files are not shipped>
+#
+
+import argparse
+from datetime import datetime
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import DruidDataDriver
+
+
+class MockFuture: # Stands in for the future kafka-python returns for each record
+    def add_callback(self, f, *args):
+        f(*args, None)
+        return self
+    def add_errback(self, f, *args):
+        return self
+
+class MockProducer: # Stands in for a KafkaProducer, so a run measures the client side of the Kafka target
+    def __init__(self):
+        self.future = MockFuture()
+    def send(self, topic, value, key=None):
+        return self.future
+    def flush(self):
+        pass
+    def close(self):
+        pass
+
+
+def get_configs(names):
+    # all the configs shipped under config_file/, or the ones named on the command line
+    if len(names) > 0:
+        return names
+    configs = glob.glob('config_file/**/*.json', recursive=True)
+    return sorted([os.path.relpath(c, 'config_file') for c in configs if not os.path.basename(c).startswith('_')])
+
+def create_printer(target_type, directory):
+    if target_type == 'null':
+        return DruidDataDriver.PrintNull()
+    elif target_type == 'file':
+        return DruidDataDriver.PrintFile(os.path.join(directory, 'bench.json'))
+    elif target_type == 'kafka':
+        return DruidDataDriver.PrintKafka('mock', 'bench', 'PLAINTEXT', None, None, 'async', producer=MockProducer())
+    msg = 'Error: Unknown benchmark target "'+target_type+'"'
+    raise Exception(msg)
+
+def time_calls(create_record, variables, samples, repeats=3):
+    # the fastest of a few repeats, so a cold first pass doesn't count
+    times = []
+    for r in range(repeats):
+        start = time.perf_counter()
+        for i in range(samples):
+            create_record(variables)
+        times.append((time.perf_counter() - start) / samples)
+    return min(times)
+
+def get_field_costs(driver, samples, copies=10):
+    # the time taken to render each field of the emitters, by the type of the field
+    # each field is compiled into a record template, as the generator renders it, repeated so the cost of the call and the join is spread out
+    variables = {}
+    for dimensions in driver.emitters.values():
+        for element in dimensions:
+            if isinstance(element, DruidDataDriver.ElementVariable):
+                variables[element.variable_name] = 'value'
+    empty = DruidDataDriver.RecordTemplate([], driver.streams).create_record
+    baseline = time_calls(empty, variables, samples)
+    costs = {}
+    for dimensions in driver.emitters.values():
+        for element in dimensions:
+            field_type = type(element).__name__[len('Element'):].lower()
+            create_record = DruidDataDriver.RecordTemplate([element] * copies, driver.streams).create_record
+            seconds = max(0.0, time_calls(create_record, variables, samples) - baseline) / copies
+            fields, total = costs.get(field_type, (0, 0.0))
+            costs[field_type] = (fields + 1, total + seconds)
+    return costs
+
+def run_case(config_name, target_type, total_recs, field_samples, replay_source, results):
+    # runs in a forked process, so its peak memory and the module's random state are its own
+    result = {'config': config_name, 'target': target_type}
+    directory = tempfile.mkdtemp(prefix='bench-')
+    try:
+        with open('config_file/'+config_name, 'r') as f:
+            config = json.load(f)
+        if replay_source is not None and config.get('type') == 'replay':
+            config['source_file'] = replay_source
+        start_time = datetime(2024, 1, 1)
+        start = time.perf_counter()
+        driver = DruidDataDriver.DataDriver('bench', config, {'type': 'stdout'}, None, total_recs, 'SIM', start_time, 100, seed=1)
+        result['startup_seconds'] = round(time.perf_counter() - start, 6)
+        driver.target_printer = create_printer(target_type, directory)
+        start = time.perf_counter()
+        driver.simulate()
+        seconds = time.perf_counter() - start
+        records = driver.sim_control.get_record_count()
+        result['records'] = records
+        result['seconds'] = round(seconds, 6)
+        result['records_per_second'] = round(records / seconds, 1) if seconds > 0 else None
+        result['bytes'] = driver.sim_control.get_byte_count()
+        if field_samples > 0 and driver.type == 'generator':
+            result['field_costs'] = get_field_costs(driver, field_samples)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_mb'] = round(peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except Exception as ex:
+        result['error'] = str(ex)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    results.put(result)
+
+def run_cases(configs, targets, total_recs, field_samples, replay_source):
+    context = multiprocessing.get_context('fork')
+    cases = []
+    for config_name in configs:
+        for target_type in targets:
+            # the field costs don't depend on the target, they are measured with the first one
+            samples = field_samples if target_type == targets[0] else 0
+            results = context.Queue()
+            p = context.Process(target=run_case, args=(config_name, target_type, total_recs, samples, replay_source, results), daemon=True)
+            p.start()
+            result = results.get()
+            p.join()
+            print_case(result)
+            cases.append(result)
+    return cases
+
+def get_field_types(cases):
+    # the mean cost of each field type across all the configs
+    field_types = {}
+    for case in cases:
+        for field_type, (fields, total) in case.pop('field_costs', {}).items():
+            count, seconds = field_types.get(field_type, (0, 0.0))
+            field_types[field_type] = (count + fields, seconds + total)
+    return {field_type: {'fields': count, 'ns_per_field': round(seconds / count * 1e9, 1)} for field_type, (count, seconds) in sorted(field_types.items())}
+
+def print_case(case):
+    if 'error' in case:
+        print(f"{case['config']:45} {case['target']:6} error: {case['error']}")
+    else:
+        print(f"{case['config']:45} {case['target']:6} {case['records_per_second']:>12} rec/s  startup {case['startup_seconds']:8.3f} s  peak RSS {case['peak_rss_mb']:7.1f} MB")
+
+def compare(cases, file_name):
+    # the ratio of the records per second of this run to those of an earlier run
+    with open(file_name, 'r') as f:
+        previous = json.load(f)
+    before = {(c['config'], c['target']): c.get('records_per_second') for c in previous['cases']}
+    print('')
+    print('Compared with '+file_name+':')
+    for case in cases:
+        rate = before.get((case['config'], case['target']))
+        if rate and case.get('records_per_second'):
+            print(f"{case['config']:45} {case['target']:6} {case['records_per_second'] / rate:8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the data driver with the shipped configs.')
+    parser.add_argument('configs', metavar='<config file name>', nargs='*', help='config file names under config_file/, defaults to all of them')
+    parser.add_argument('-n', dest='n_recs', type=int, default=20000, help='the number of records to generate in each run')
+    parser.add_argument('-o', dest='output', default='bench_results.json', help='the file the results are saved to')
+    parser.add_argument('--targets', dest='targets', default='null,file,kafka', help='comma-separated targets to run against: null, file and kafka (a mock producer)')
+    parser.add_argument('--field-samples', dest='field_samples', type=int, default=10000, help='the number of times each field is rendered to measure its cost, 0 to skip')
+    parser.add_argument('--compare', dest='compare', help='the results file of an earlier run to compare with')
+    parser.add_argument('--replay-source', dest='replay_source', help='the file to replay in the replay configs instead of their source_file')
+    args = parser.parse_args()
+
+    targets = args.targets.split(',')
+    cases = run_cases(get_configs(args.configs), targets, args.n_recs, args.field_samples, args.replay_source)
+    field_types = get_field_types(cases)
+    print('')
+    for field_type, cost in field_types.items():
+        print(f"{field_type:10} {cost['ns_per_field']:10.1f} ns per field ({cost['fields']} fields)")
+
+    results = {'date': datetime.now().isoformat(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'records': args.n_recs,
+               'cases': cases,
+               'field_types': field_types}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('')
+    print('Results saved to '+args.output)
+    if args.compare is not None:
+        compare(cases, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#
+# Checks the data driver. Each check runs a small job, or drives a target with a
+# stand-in for its service, and raises an exception when the result is wrong.
+#
+# Run the checks from the root of the repository as follows:
+# python generator/check.py [check names]
+# Without names, all the checks are run.
+#
+
+import argparse
+from datetime import datetime
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import DruidDataDriver
+
+
+class CapturePrinter: # Keeps the records, so a check can look at them
+    def __init__(self):
+        self.records = []
+    def __str__(self):
+        return 'CapturePrinter(records='+str(len(self.records))+')'
+    def print(self, record, values=None):
+        self.records.append(record)
+    def flush(self):
+        pass
+    def close(self):
+        pass
+
+class FakeFuture: # Stands in for the future kafka-python returns from send()
+    def __init__(self):
+        self.callbacks = []
+        self.errbacks = []
+    def add_callback(self, f, *args):
+        self.callbacks.append((f, args))
+    def add_errback(self, f, *args):
+        self.errbacks.append((f, args))
+    def resolve(self, exception=None):
+        # as in kafka-python, the result is passed after the arguments given with the callback
+        for f, args in self.errbacks if exception is not None else self.callbacks:
+            f(*args, exception if exception is not None else 'metadata')
+
+class FakeKafkaProducer: # Stands in for a KafkaProducer, failing the deliveries of the records in fail
+    def __init__(self, fail=[]):
+        self.fail = fail
+        self.calls = []
+        self.pending = []
+        self.sent = []
+    def send(self, topic, value, key=None):
+        if 'close' in self.calls:
+            msg = 'Error: send() after close()'
+            raise Exception(msg)
+        self.calls.append('send')
+        self.sent.append((topic, value, key))
+        future = FakeFuture()
+        self.pending.append((value, future))
+        return future
+    def flush(self):
+        self.calls.append('flush')
+        pending, self.pending = self.pending, []
+        for value, future in pending:
+            future.resolve(Exception('delivery failed') if value in self.fail else None)
+    def close(self):
+        self.calls.append('close')
+
+class FakeMessage:
+    def latency(self):
+        return 0.001
+
+class FakeConfluentProducer: # Stands in for a confluent_kafka Producer with a queue of queue_size records
+    def __init__(self, fail=[], queue_size=2):
+        self.fail = fail
+        self.queue_size = queue_size
+        self.calls = []
+        self.queue = []
+        self.sent = []
+    def __len__(self):
+        return len(self.queue)
+    def produce(self, topic, value, key, on_delivery):
+        if len(self.queue) >= self.queue_size:
+            self.calls.append('full')
+            raise BufferError()
+        self.calls.append('produce')
+        self.sent.append((topic, value, key))
+        self.queue.append((value, on_delivery))
+    def poll(self, timeout):
+        # a poll that waits delivers the queue, one that doesn't wait delivers nothing
+        self.calls.append('poll')
+        if timeout > 0:
+            self.deliver()
+    def flush(self):
+        self.calls.append('flush')
+        self.deliver()
+    def deliver(self):
+        queue, self.queue = self.queue, []
+        for value, on_delivery in queue:
+            on_delivery('delivery failed' if value in self.fail else None, FakeMessage())
+
+
+def get_generator_config(dimensions):
+    # a single emitter with the given dimensions, emitted once a second by each entity
+    return {'emitters': [{'name': 'check', 'dimensions': dimensions}],
+            'interarrival': {'type': 'constant', 'value': 1},
+            'states': [{'name': 'state_1',
+                        'emitter': 'check',
+                        'delay': {'type': 'constant', 'value': 1},
+                        'transitions': [{'next': 'state_1', 'probability': 1.0}]}]}
+
+def run_job(config, total_recs, batch_size=None, seed=1):
+    # runs the job with a simulated clock and returns its records
+    driver = DruidDataDriver.DataDriver('check', config, {'type': 'stdout'}, None, total_recs, 'SIM', datetime(2024, 1, 1), 10, batch_size, seed=seed)
+    driver.target_printer = CapturePrinter()
+    driver.simulate()
+    return driver.target_printer.records
+
+def get_replay_config(source_file, source_format):
+    return {'type': 'replay',
+            'source_file': source_file,
+            'source_format': source_format,
+            'time_field': 'ts',
+            'time_format': 'epoch'}
+
+def write_source_files(directory, source_format, rows, count=1):
+    # writes the rows to count source files of the format, each with its own times
+    files = []
+    for i in range(count):
+        file_rows = [dict(row, ts=row['ts'] + i) for row in rows]
+        file_name = os.path.join(directory, 'source-'+str(i)+'.'+source_format)
+        if source_format == 'csv':
+            with open(file_name, 'w') as f:
+                f.write(','.join(rows[0].keys())+'\n')
+                for row in file_rows:
+                    f.write(','.join(json.dumps(v) if isinstance(v, bool) else str(v) for v in row.values())+'\n')
+        elif source_format == 'json':
+            with open(file_name, 'w') as f:
+                for row in file_rows:
+                    f.write(json.dumps(row)+'\n')
+        else:
+            import pyarrow
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(pyarrow.Table.from_pylist(file_rows), file_name)
+        files.append(file_name)
+    return files
+
+def check_equal(name, value, expected):
+    if value != expected:
+        msg = 'Error: '+name+' is '+str(value)+', expected '+str(expected)
+        raise Exception(msg)
+
+
+def check_counter_nulls():
+    # a nullable counter renders through the record template and in batches, and only advances for the records it is in
+    config = get_generator_config([{'type': 'counter', 'name': 'n', 'start': 1, 'increment': 1, 'percent_nulls': 50.0}])
+    for batch_size in [None, 10]:
+        values = [json.loads(record)['n'] for record in run_job(config, 200, batch_size)]
+        counts = [int(v) for v in values if v is not None]
+        check_equal('the number of records', len(values), 200)
+        if len(counts) == 0 or len(counts) == len(values):
+            msg = 'Error: a counter with 50% nulls had '+str(len(values) - len(counts))+' nulls in '+str(len(values))+' records'
+            raise Exception(msg)
+        check_equal('the counter values', counts, list(range(1, len(counts) + 1)))
+
+
+def check_replay_columnar():
+    # replayed values of every type are written to a columnar target as strings
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return 'requires pyarrow'
+    rows = [{'ts': 1700000000.0, 'value': 1.5, 'count': 3, 'ok': True},
+            {'ts': 1700000001.0, 'value': 2.5, 'count': 4, 'ok': False}]
+    directory = tempfile.mkdtemp(prefix='check-')
+    try:
+        for source_format in ['csv', 'json', 'parquet']:
+            files = write_source_files(directory, source_format, rows)
+            target_file = os.path.join(directory, source_format+'.parquet')
+            driver = DruidDataDriver.DataDriver('check', get_replay_config(files[0], source_format), {'type': 'parquet', 'path': target_file}, None, 4, 'SIM', datetime(2024, 1, 1), 10)
+            driver.simulate()
+            table = pyarrow.parquet.read_table(target_file)
+            check_equal(source_format+' column types', set(str(t) for t in table.schema.types), {'string'})
+            check_equal(source_format+' values', table.column('value').to_pylist(), ['1.5', '2.5', '1.5', '2.5'])
+            check_equal(source_format+' booleans', table.column('ok').to_pylist(), ['true', 'false', 'true', 'false'])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def check_replay_error():
+    # an error in one of several replay threads ends the job and is raised, instead of leaving the other threads waiting
+    rows = [{'ts': 1700000000.0, 'value': 1}, {'ts': 1700000001.0, 'value': 2}]
+    directory = tempfile.mkdtemp(prefix='check-')
+    try:
+        write_source_files(directory, 'json', rows, count=3)
+        # the last file has no rows, so its thread fails
+        open(os.path.join(directory, 'source-2.json'), 'w').close()
+        for time_type in ['SIM', 'REAL']:
+            driver = DruidDataDriver.DataDriver('check', get_replay_config(os.path.join(directory, 'source-*.json'), 'json'), {'type': 'file', 'path': os.path.join(directory, 'out.json')}, None, 100, time_type, datetime(2024, 1, 1), 10)
+            errors = []
+            def run():
+                try:
+                    driver.simulate()
+                except Exception as e:
+                    errors.append(str(e))
+            thrd = threading.Thread(target=run, daemon=True)
+            thrd.start()
+            thrd.join(30)
+            if thrd.is_alive():
+                msg = 'Error: the '+time_type+' replay job did not end after one of its threads failed'
+                raise Exception(msg)
+            check_equal(time_type+' errors', [e.endswith('has no rows') for e in errors], [True])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def check_stdout_flush():
+    # a record printed by a thread that then stops printing is written once the flush interval has passed
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        printer = DruidDataDriver.PrintStdout(flush_interval=0.1)
+        printer.print('{"n": 1}')
+        time.sleep(1.0)
+        written = sys.stdout.getvalue()
+        printer.close()
+    finally:
+        sys.stdout = stdout
+    check_equal('the output after the flush interval', written, '{"n": 1}\n')
+
+def check_file_flush():
+    # a record printed to a file before a pause is written once the flush interval has passed
+    directory = tempfile.mkdtemp(prefix='check-')
+    try:
+        file_name = os.path.join(directory, 'out.json')
+        printer = DruidDataDriver.PrintFile(file_name, flush_interval=0.1)
+        printer.print('{"n": 1}')
+        time.sleep(1.0)
+        with open(file_name) as f:
+            written = f.read()
+        printer.close()
+        check_equal('the file after the flush interval', written, '{"n": 1}\n')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def check_ended_threads():
+    # the counts of the threads that have ended are kept, and their counters are dropped
+    clock = DruidDataDriver.Clock('SIM', datetime(2024, 1, 1))
+    sim_control = DruidDataDriver.SimEnd(1000, None, clock)
+    def run():
+        for i in range(10):
+            if sim_control.claim_record():
+                sim_control.inc_rec_count(5)
+        sim_control.end_thread()
+    for i in range(50):
+        thrd = threading.Thread(target=run)
+        thrd.start()
+        thrd.join()
+    check_equal('the number of counters', len(sim_control.counters), 0)
+    check_equal('the record count', sim_control.get_record_count(), 500)
+    check_equal('the byte count', sim_control.get_byte_count(), 2500)
+    check_equal('the claimed records', sim_control.claimed, 500)
+
+def check_terminate_wait():
+    # terminating a job whose clock waits for the next event in real time ends it without waiting for the event
+    config = get_generator_config([{'type': 'counter', 'name': 'n'}])
+    config['interarrival'] = {'type': 'constant', 'value': 30}
+    driver = DruidDataDriver.DataDriver('check', config, {'type': 'null'}, None, None, 'SIM_TO_REAL', datetime.now(), 10)
+    thrd = threading.Thread(target=driver.simulate, daemon=True)
+    thrd.start()
+    time.sleep(0.5)
+    driver.terminate()
+    thrd.join(10)
+    if thrd.is_alive():
+        msg = 'Error: the job did not end when it was terminated'
+        raise Exception(msg)
+
+def check_job_block_size():
+    # each job draws its samples in blocks of its own size, a job created later doesn't change the size of another
+    sizes = [7, None]
+    drivers = []
+    for size in sizes:
+        config = get_generator_config([{'type': 'counter', 'name': 'n'}])
+        config['interarrival'] = {'type': 'exponential', 'mean': 1}
+        if size is not None:
+            config['sample_block_size'] = size
+        drivers.append(DruidDataDriver.DataDriver('check', config, {'type': 'null'}, None, 10, 'SIM', datetime(2024, 1, 1), 10))
+    check_equal('the block sizes', [driver.rate_delay.buffer.block_size for driver in drivers], [7, 1024])
+
+def check_kafka_delivery():
+    # failed deliveries are counted, the records are flushed when the job is terminated, and the producer is closed last
+    producer = FakeKafkaProducer(fail=[b'{"n": 2}'])
+    printer = DruidDataDriver.PrintKafka('localhost:9092', 'check', None, None, DruidDataDriver.RecordKey(['n']), 'async', producer=producer)
+    for n in range(1, 4):
+        printer.print('{"n": '+str(n)+'}', {'n': str(n)})
+    check_equal('the calls before the flush', producer.calls, ['send'] * 3)
+    check_equal('the keys', [key for topic, value, key in producer.sent], [b'1', b'2', b'3'])
+    driver = DruidDataDriver.DataDriver('check', get_generator_config([{'type': 'counter', 'name': 'n'}]), {'type': 'null'}, None, 10, 'SIM', datetime(2024, 1, 1), 10)
+    driver.target_printer = printer
+    driver.terminate()
+    check_equal('the calls after terminate()', producer.calls, ['send'] * 3 + ['flush'])
+    check_equal('the delivery failures', printer.delivery_failures, 1)
+    check_equal('the delivered records', printer.latency.count, 2)
+    printer.close()
+    # a flush after the target is closed, from a late terminate(), doesn't reach the closed producer
+    printer.flush()
+    check_equal('the calls after close()', producer.calls, ['send'] * 3 + ['flush', 'flush', 'close'])
+    # in sync mode each record is flushed as it is sent
+    producer = FakeKafkaProducer(fail=[b'{"n": 1}'])
+    printer = DruidDataDriver.PrintKafka('localhost:9092', 'check', None, None, None, producer=producer)
+    printer.print('{"n": 1}')
+    printer.print('{"n": 2}')
+    check_equal('the sync calls', producer.calls, ['send', 'flush'] * 2)
+    check_equal('the sync delivery failures', printer.delivery_failures, 1)
+
+def check_confluent_delivery():
+    # a full producer queue is polled until there is room, failed deliveries are counted, and terminate() flushes the queue
+    producer = FakeConfluentProducer(fail=['{"n": 3}'])
+    printer = DruidDataDriver.PrintConfluent('localhost:9092', 'check', 'user', 'password', None, producer=producer)
+    for n in range(1, 5):
+        printer.print('{"n": '+str(n)+'}')
+    check_equal('the calls before the flush', producer.calls, ['produce', 'poll', 'produce', 'poll', 'full', 'poll', 'produce', 'poll', 'produce', 'poll'])
+    check_equal('the queue depth', printer.get_queue_depth(), 2)
+    check_equal('the delivery failures before the flush', printer.delivery_failures, 0)
+    driver = DruidDataDriver.DataDriver('check', get_generator_config([{'type': 'counter', 'name': 'n'}]), {'type': 'null'}, None, 10, 'SIM', datetime(2024, 1, 1), 10)
+    driver.target_printer = printer
+    driver.terminate()
+    check_equal('the queue depth after terminate()', printer.get_queue_depth(), 0)
+    check_equal('the delivery failures', printer.delivery_failures, 1)
+    check_equal('the delivered records', printer.latency.count, 3)
+    check_equal('the records sent', [value for topic, value, key in producer.sent], ['{"n": '+str(n)+'}' for n in range(1, 5)])
+
+
+checks = {'counter_nulls': check_counter_nulls,
+          'replay_columnar': check_replay_columnar,
+          'replay_error': check_replay_error,
+          'stdout_flush': check_stdout_flush,
+          'file_flush': check_file_flush,
+          'ended_threads': check_ended_threads,
+          'terminate_wait': check_terminate_wait,
+          'job_block_size': check_job_block_size,
+          'kafka_delivery': check_kafka_delivery,
+          'confluent_delivery': check_confluent_delivery}
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks the data driver.')
+    parser.add_argument('names', metavar='<check name>', nargs='*', help='the checks to run, defaults to all of them: '+', '.join(checks.keys()))
+    args = parser.parse_args()
+
+    names = args.names if len(args.names) > 0 else list(checks.keys())
+    failures = 0
+    for name in names:
+        if name not in checks.keys():
+            print('Unknown check '+name)
+            failures += 1
+            continue
+        try:
+            # a check that needs a module that isn't installed returns the reason it was skipped
+            skipped = checks[name]()
+            if skipped is not None:
+                print('skipped '+name+': '+skipped)
+            else:
+                print('ok      '+name)
+        except Exception:
+            print('FAILED  '+name)
+            traceback.print_exc()
+            failures += 1
+    if failures > 0:
+        print(str(failures)+' of '+str(len(names))+' checks failed')
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
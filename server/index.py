@@ -103,6 +103,54 @@ def find_job(name):
             break;
     return result
 
+def prometheus_label(labels):
+    # label values escape backslashes, quotes and new lines
+    pairs = [name+'="'+str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')+'"' for name, value in labels.items()]
+    return '{'+','.join(pairs)+'}'
+
+def prometheus_metrics(reports):
+    # families of metrics, each with its type, help text and samples
+    families = {}
+    def add(family, kind, help_text, sample, labels, value):
+        if value is None:
+            return
+        if family not in families:
+            families[family] = (kind, help_text, [])
+        families[family][2].append(sample+prometheus_label(labels)+' '+str(value))
+
+    for report in reports:
+        job = {'job': report['name']}
+        metrics = report['metrics']
+        add('datagen_records_total', 'counter', 'Records emitted by the job.', 'datagen_records_total', job, report['total_records'])
+        add('datagen_bytes_total', 'counter', 'Size of the JSON records emitted by the job.', 'datagen_bytes_total', job, metrics['bytes'])
+        add('datagen_running', 'gauge', 'Whether the job is running.', 'datagen_running', job, 1 if report['status'] == 'RUNNING' else 0)
+        if metrics['records_per_second'] is not None:
+            for window, rate in metrics['records_per_second'].items():
+                add('datagen_records_per_second', 'gauge', 'Records emitted per second over a sliding window.', 'datagen_records_per_second', dict(job, window=window), rate)
+        if 'send_latency' in metrics:
+            target = dict(job, target=report['target']['type'])
+            latency = metrics['send_latency']
+            family = 'datagen_send_latency_seconds'
+            help_text = 'Time taken by the target to write or deliver a block of records.'
+            for bound, count in latency['buckets']:
+                add(family, 'histogram', help_text, family+'_bucket', dict(target, le=bound), count)
+            add(family, 'histogram', help_text, family+'_sum', target, latency['sum'])
+            add(family, 'histogram', help_text, family+'_count', target, latency['count'])
+        if 'pacing_error' in metrics:
+            for stat in ['mean_lag', 'max_lag']:
+                add('datagen_pacing_lag_seconds', 'gauge', 'How late records were emitted compared to their schedule.', 'datagen_pacing_lag_seconds', dict(job, stat=stat[:-4]), metrics['pacing_error'][stat])
+        for queue, depth in metrics['queue_depth'].items():
+            add('datagen_queue_depth', 'gauge', 'Number of items waiting in a queue of the job.', 'datagen_queue_depth', dict(job, queue=queue), depth)
+        if 'delivery_failures' in report:
+            add('datagen_delivery_failures_total', 'counter', 'Records the target failed to deliver.', 'datagen_delivery_failures_total', job, report['delivery_failures'])
+
+    lines = []
+    for family, (kind, help_text, samples) in families.items():
+        lines.append('# HELP '+family+' '+help_text)
+        lines.append('# TYPE '+family+' '+kind)
+        lines.extend(samples)
+    return '\n'.join(lines)+'\n'
+
 def delete_file(filename):
     try:
         if os.path.exists(filename):
@@ -204,6 +252,13 @@ def get_status(name):
     except Exception as ex:
         return '{"message":"ERROR in creating report.","exception":'+f'{ex}'+'}', 400
 
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    try:
+        reports = [server.report() for server in server_list]
+        return prometheus_metrics(reports), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    except Exception as ex:
+        return '{"message":"ERROR in creating metrics.","exception":'+f'{ex}'+'}', 400
 
 @app.route("/stop/<name>", methods=['POST'])
 def stop_generator(name):